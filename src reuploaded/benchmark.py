@@ -0,0 +1,253 @@
+import argparse
+import copy
+import glob
+import json
+import multiprocessing.pool as mpool
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import fitness_cache
+import ga
+import metrics
+import tiles
+
+# Benchmarks for metrics, the path searches and the GA operators, over a fixed corpus of levels:
+# the committed levels/*.txt, seeded random Individual_Grid and Individual_DE levels, open levels
+# (the worst case for the searches) and levels that can't be finished.  Results go to a JSON file;
+# pass --baseline with an earlier one to see how each benchmark's median moved.
+#
+#     python benchmark.py [--quick] [--output benchmark.json] [--baseline old.json]
+
+
+# The corpus: (name, level) pairs, levels as lists of strings.  The same for the same seed.
+def corpus(seed=0, random_count=6):
+    levels = []
+    for path in sorted(glob.glob("levels/*.txt")):
+        with open(path) as f:
+            rows = [line.rstrip("\n") for line in f if line.strip()]
+        if len(rows) == ga.height and all(len(row) == len(rows[0]) for row in rows):
+            levels.append(("file:" + os.path.basename(path), rows))
+    state = random.getstate()
+    random.seed(seed)
+    for i in range(random_count):
+        levels.append(("grid:%d" % i, tiles.rows(ga.Individual_Grid.random_individual().to_level())))
+    for i in range(random_count):
+        levels.append(("de:%d" % i, tiles.rows(ga.Individual_DE.random_individual().to_level())))
+    random.setstate(state)
+    empty = tiles.rows(ga.Individual_Grid.empty_individual().to_level())
+    levels.append(("open:empty", empty))
+    # open sky with a floor and nothing else, so the searches have every cell to try
+    levels.append(("open:floor", ["-" * ga.width] * (ga.height - 1) + ["X" * ga.width]))
+    # a wall at the start: the searches give up straight away
+    walled = [row[:4] + "X" + row[5:] for row in empty]
+    levels.append(("unsolvable:wall", walled))
+    # a pit two-thirds of the way along: a lot of level to search before giving up
+    pit = 2 * ga.width // 3
+    levels.append(("unsolvable:pit", empty[:-1] + [empty[-1][:pit] + "-" * 8 + empty[-1][pit + 8:]]))
+    return levels
+
+
+# Percentiles and mean, in milliseconds, of some timings in seconds.
+def summary(seconds):
+    ms = np.array(seconds) * 1000.0
+    return {"calls": len(ms),
+            "mean_ms": float(ms.mean()),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p90_ms": float(np.percentile(ms, 90)),
+            "p99_ms": float(np.percentile(ms, 99))}
+
+
+# Time function(argument) for each argument, repeats times over.
+def latency(function, arguments, repeats):
+    timings = []
+    for _repeat in range(repeats):
+        for argument in arguments:
+            start = time.perf_counter()
+            function(argument)
+            timings.append(time.perf_counter() - start)
+    return summary(timings)
+
+
+# Peak traced memory of one call of function(argument), for each argument, in KiB.
+def allocations(function, arguments):
+    peaks = []
+    tracemalloc.start()
+    try:
+        for argument in arguments:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            function(argument)
+            peaks.append((tracemalloc.get_traced_memory()[1] - base) / 1024.0)
+    finally:
+        tracemalloc.stop()
+    return {"peak_kib_mean": float(np.mean(peaks)), "peak_kib_max": float(np.max(peaks))}
+
+
+# Tracing allocations makes metrics many times slower, so it is optional.
+def bench_metrics(levels, repeats, trace=True):
+    results = {}
+    for name, level in levels:
+        analysis = metrics.analyze(level)
+        result = latency(metrics.metrics, [level], repeats)
+        # distinct cells the search expanded, and the states it popped and pushed (none when
+        # reachableColumns showed the end out of reach and the search was skipped)
+        result["cells_visited"] = analysis.visitedCount
+        result["states_popped"] = analysis.stats.popped
+        result["states_pushed"] = analysis.stats.pushed
+        result["solvable"] = analysis.measurements["solvability"] == 1
+        if trace:
+            result.update(allocations(metrics.metrics, [level]))
+        results[name] = result
+    results["all"] = latency(metrics.metrics, [level for _name, level in levels], repeats)
+    # the whole corpus in one call, so compare it with "all" times the number of levels
+    results["batch"] = latency(metrics.metrics_batch, [[level for _name, level in levels]], repeats)
+    return results
+
+
+def bench_searches(levels, repeats):
+    everything = [level for _name, level in levels]
+    return {"reachability": latency(metrics.reachability, everything, repeats),
+            "solvable": latency(metrics.solvable, everything, repeats),
+            "shortestPathLength": latency(metrics.shortestPathLength, everything, repeats),
+            "constraintDistance": latency(metrics.constraintDistance, everything, repeats)}
+
+
+def bench_operators(repeats, seed=0):
+    state = random.getstate(), ga.compact_grid
+    random.seed(seed)
+    results = {}
+    try:
+        for compact in (False, True):
+            ga.compact_grid = compact
+            grids = [ga.Individual_Grid.random_individual() for _i in range(8)]
+            pairs = list(zip(grids, grids[1:] + grids[:1]))
+            label = "grid_compact" if compact else "grid_list"
+            results[label + ".generate_children"] = latency(lambda pair: pair[0].generate_children(pair[1]),
+                                                            pairs, repeats)
+            # list genomes are mutated in place, so each call gets a copy to keep the inputs fixed
+            results[label + ".mutate"] = latency(lambda individual: individual.mutate(copy.deepcopy(individual.genome)),
+                                                 grids, repeats)
+        ga.compact_grid = False
+        des = [ga.Individual_DE.random_individual() for _i in range(8)]
+        pairs = list(zip(des, des[1:] + des[:1]))
+        results["de.generate_children"] = latency(lambda pair: pair[0].generate_children(pair[1]), pairs, repeats)
+        results["de.render"] = latency(lambda individual: ga.paint(ga.base_template.copy(), individual.genome),
+                                       des, repeats)
+        for individual in des:
+            individual.render()
+        children = [child for a, b in pairs for child in a.generate_children(b)]
+        results["de.render_from_parent"] = latency(_render_fresh, children, repeats)
+    finally:
+        random.setstate(state[0])
+        ga.compact_grid = state[1]
+    return results
+
+
+# Render a copy of child from its parent's level, leaving child itself unrendered.
+def _render_fresh(child):
+    copy = ga.Individual_DE(child.genome)
+    copy._parent = child._parent
+    return copy.render()
+
+
+# One generation of breeding and evaluation, with no fitness cache, for each population size and
+# number of processes.
+def bench_generations(pop_limits, process_counts, seed=0):
+    results = {}
+    state = random.getstate()
+    try:
+        for individual_class in (ga.Individual_DE, ga.Individual_Grid):
+            for processes in process_counts:
+                with mpool.Pool(processes=processes, initializer=fitness_cache.install, initargs=(None,)) as pool:
+                    for pop_limit in pop_limits:
+                        random.seed(seed)
+                        ga.Individual = individual_class
+                        batch_size = int(np.ceil(pop_limit / processes))
+                        population = ga.evaluate(pool, [individual_class.random_individual()
+                                                         for _i in range(pop_limit)], batch_size)
+                        start = time.perf_counter()
+                        next_population = ga.generate_successors(population)
+                        bred = time.perf_counter()
+                        ga.evaluate(pool, next_population, batch_size)
+                        done = time.perf_counter()
+                        results["%s.pop%d.procs%d" % (individual_class.__name__, pop_limit, processes)] = {
+                            "breed_s": bred - start,
+                            "evaluate_s": done - bred,
+                            "individuals_per_s": pop_limit / (done - start)}
+    finally:
+        random.setstate(state)
+        ga.Individual = ga.Individual_DE
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "commit": commit or None,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+# Every (section, benchmark, key) number in a results file, flattened to "section/benchmark" -> value.
+def medians(results):
+    flat = {}
+    for section, benchmarks in results["results"].items():
+        for name, numbers in benchmarks.items():
+            if "p50_ms" in numbers:
+                flat[section + "/" + name] = numbers["p50_ms"]
+            elif "individuals_per_s" in numbers:
+                flat[section + "/" + name] = numbers["individuals_per_s"]
+    return flat
+
+
+def compare(results, baseline):
+    now = medians(results)
+    before = medians(baseline)
+    print("%-60s %12s %12s %8s" % ("benchmark (median ms, or individuals/s)", "baseline", "now", "ratio"))
+    for name in sorted(now):
+        if name in before and before[name]:
+            print("%-60s %12.3f %12.3f %8.2f" % (name, before[name], now[name], now[name] / before[name]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark metrics, the path searches and the GA operators.")
+    parser.add_argument("--output", default="benchmark.json", help="where to save the results")
+    parser.add_argument("--baseline", help="an earlier results file to compare against")
+    parser.add_argument("--quick", action="store_true",
+                        help="fewer repeats and smaller generations, and no allocation tracing")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    repeats = 1 if args.quick else 5
+    pop_limits = [24] if args.quick else [48, 96, 192]
+    process_counts = sorted({1, os.cpu_count()})
+    levels = corpus(args.seed)
+    print("Corpus:", len(levels), "levels")
+    results = {"environment": environment(), "results": {}}
+    for section, run in [("metrics", lambda: bench_metrics(levels, repeats, not args.quick)),
+                         ("searches", lambda: bench_searches(levels, repeats)),
+                         ("operators", lambda: bench_operators(repeats * 4, args.seed)),
+                         ("generations", lambda: bench_generations(pop_limits, process_counts, args.seed))]:
+        start = time.time()
+        results["results"][section] = run()
+        print("Ran", section, "benchmarks in", time.time() - start, "seconds")
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print("Saved results to", args.output)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
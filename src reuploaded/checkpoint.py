@@ -0,0 +1,62 @@
+import os
+import pickle
+import threading
+import zlib
+
+# Checkpoints of a ga() run: a short header and then the zlib-compressed pickle of a dict of run
+# state (see ga.ga for what's in it).  Files are written next to their destination and renamed
+# over it, so a run killed mid-write leaves the previous checkpoint intact.
+
+MAGIC = b"P5GA\x02"
+
+
+def loads(data):
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a GA checkpoint (or one from another version)")
+    return pickle.loads(zlib.decompress(data[len(MAGIC):]))
+
+
+# Write data to path atomically.
+def write(path, data):
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def load(path):
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+# Saves checkpoints to one path without holding up the caller: the state is pickled straight away
+# (so later changes to it don't leak in) and compressed and written on a background thread.  Only
+# one write is ever in progress; saving again first waits for the last one.
+class Checkpointer(object):
+    def __init__(self, path):
+        self.path = path
+        self._thread = None
+        self._error = None
+
+    def save(self, state):
+        data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(data,), daemon=True)
+        self._thread.start()
+
+    def _write(self, data):
+        try:
+            write(self.path, MAGIC + zlib.compress(data, 1))
+        except Exception as e:
+            self._error = e
+
+    # Wait for the last write to finish, raising anything it raised.
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
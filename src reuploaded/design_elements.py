@@ -0,0 +1,53 @@
+import bisect
+import collections
+
+# An Individual_DE genome: its design elements kept sorted by X, then type, then the other
+# parameters (the tuples' own order), with a running count of each type.  Indexing and slicing
+# follow that order, so a slice really is the elements from one part of the level.
+
+
+class DesignElements(object):
+    __slots__ = ["elements", "counts"]
+
+    def __init__(self, elements=()):
+        self.elements = sorted(elements)
+        self.counts = collections.Counter(de[1] for de in self.elements)
+
+    # Only the elements are pickled; the counts are rebuilt from them.
+    def __reduce__(self):
+        return DesignElements, (self.elements,)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __iter__(self):
+        return iter(self.elements)
+
+    # An element, or a list of them for a slice
+    def __getitem__(self, index):
+        return self.elements[index]
+
+    def __eq__(self, other):
+        return isinstance(other, DesignElements) and self.elements == other.elements
+
+    def __repr__(self):
+        return "DesignElements(" + repr(self.elements) + ")"
+
+    # How many elements of de_type there are.
+    def count(self, de_type):
+        return self.counts[de_type]
+
+    def add(self, de):
+        bisect.insort(self.elements, de)
+        self.counts[de[1]] += 1
+
+    # Take out the element at index and return it.
+    def pop(self, index):
+        de = self.elements.pop(index)
+        self.counts[de[1]] -= 1
+        return de
+
+    # Put de in place of the element at index, keeping everything sorted.
+    def replace(self, index, de):
+        self.pop(index)
+        self.add(de)
@@ -0,0 +1,88 @@
+import math
+import numpy as np
+import tiles
+from multiprocessing import resource_tracker, shared_memory
+
+# Calculating the fitness of a population of Individual_Grids without pickling them.  Every genome
+# is written as tile codes (see tiles.py) into one shared memory block, the workers build each
+# individual straight from its slice of the block, and all that comes back is one float of fitness
+# per individual, written into a second block.  The blocks are made once and reused every
+# generation, so the only thing that goes through the pool is (block names, start, stop).
+#
+# Make the evaluator before the pool: the workers then share the main process's resource tracker,
+# and the blocks are only ever cleaned up by close().
+
+
+class SharedEvaluator(object):
+    def __init__(self, individual_class, shape, batches):
+        resource_tracker.ensure_running()
+        self.individual_class = individual_class
+        self.shape = shape
+        self.batches = batches
+        self.capacity = 0
+        self.genomes = None
+        self.fitnesses = None
+
+    # Make sure the blocks can hold count individuals, replacing them if they can't.
+    def reserve(self, count):
+        if count <= self.capacity:
+            return
+        self.close()
+        self.capacity = count
+        self.genomes = shared_memory.SharedMemory(create=True, size=count * self.shape[0] * self.shape[1])
+        self.fitnesses = shared_memory.SharedMemory(create=True, size=count * 8)
+
+    # Calculate the fitness of every individual in population, in place, and return it.
+    def evaluate(self, pool, population):
+        count = len(population)
+        if count == 0:
+            return population
+        self.reserve(count)
+        genomes = np.ndarray((self.capacity,) + self.shape, dtype=np.uint8, buffer=self.genomes.buf)
+        for i, individual in enumerate(population):
+            genomes[i] = tiles.encode(individual.genome)
+        batch_size = int(math.ceil(count / self.batches))
+        pool.map(evaluate_range,
+                 [(self.individual_class, self.genomes.name, self.fitnesses.name, self.shape, self.capacity,
+                   start, min(start + batch_size, count))
+                  for start in range(0, count, batch_size)],
+                 1)
+        fitnesses = np.ndarray((self.capacity,), dtype=np.float64, buffer=self.fitnesses.buf)
+        for individual, fitness in zip(population, fitnesses[:count].tolist()):
+            individual._fitness = fitness
+        del genomes, fitnesses
+        return population
+
+    def close(self):
+        for block in (self.genomes, self.fitnesses):
+            if block is not None:
+                block.close()
+                block.unlink()
+        self.genomes = None
+        self.fitnesses = None
+        self.capacity = 0
+
+
+# Blocks this worker has attached to, by name
+_attached = {}
+
+
+# Attach to the named blocks, letting go of any others from before the main process replaced them.
+def attach(*names):
+    for name in list(_attached):
+        if name not in names:
+            _attached.pop(name).close()
+    for name in names:
+        if name not in _attached:
+            _attached[name] = shared_memory.SharedMemory(name=name)
+    return [_attached[name] for name in names]
+
+
+# Worker side of SharedEvaluator.evaluate: calculate fitness for individuals start to stop - 1.
+def evaluate_range(task):
+    individual_class, genomes_name, fitnesses_name, shape, capacity, start, stop = task
+    genomes_block, fitnesses_block = attach(genomes_name, fitnesses_name)
+    genomes = np.ndarray((capacity,) + shape, dtype=np.uint8, buffer=genomes_block.buf)
+    fitnesses = np.ndarray((capacity,), dtype=np.float64, buffer=fitnesses_block.buf)
+    for i in range(start, stop):
+        fitnesses[i] = individual_class(genomes[i]).fitness()
@@ -0,0 +1,131 @@
+import collections
+import hashlib
+import json
+import multiprocessing
+import sqlite3
+import metrics
+
+# Level measurements keyed by a hash of the rendered level, so a level that comes round again (a
+# duplicate picked by selection, a child identical to its parent, the same level in a later run
+# or another sweep) is only measured once.  Measurements rather than fitness are kept, so changing
+# the fitness coefficients doesn't invalidate anything.
+#
+# Each process keeps its own bounded LRU of recent levels.  With a path, measurements also go to a
+# SQLite file that every process and every later run shares; delete it if metrics.py changes.
+# Hit and miss counts live in shared memory, so they cover the pool workers too.
+
+
+class FitnessCache(object):
+    __slots__ = ["size", "path", "counters", "entries", "_db"]
+
+    def __init__(self, size=4096, path=None, counters=None):
+        self.size = size
+        self.path = path
+        # hits, misses
+        self.counters = counters if counters is not None else multiprocessing.Array("q", 2)
+        self.entries = collections.OrderedDict()
+        self._db = None
+
+    # Only the settings travel to pool workers; each process opens its own connection.
+    def __getstate__(self):
+        return self.size, self.path, self.counters
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def db(self):
+        if self._db is None and self.path is not None:
+            self._db = sqlite3.connect(self.path, timeout=60)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS measurements (key BLOB PRIMARY KEY, value TEXT)")
+            self._db.commit()
+        return self._db
+
+    @staticmethod
+    def key(level):
+        grid = metrics.levelGrid(level)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr(grid.shape).encode("ascii"))
+        digest.update(grid.tobytes())
+        return digest.digest()
+
+    def count(self, hit):
+        with self.counters.get_lock():
+            self.counters[0 if hit else 1] += 1
+
+    def get(self, key):
+        measurements = self.entries.get(key)
+        if measurements is not None:
+            self.entries.move_to_end(key)
+        elif self.db() is not None:
+            row = self.db().execute("SELECT value FROM measurements WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                measurements = json.loads(row[0])
+                self.remember(key, measurements)
+        self.count(measurements is not None)
+        return measurements
+
+    def remember(self, key, measurements):
+        self.entries[key] = measurements
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def put(self, key, measurements):
+        self.remember(key, measurements)
+        if self.db() is not None:
+            with self.db():
+                self.db().execute("INSERT OR REPLACE INTO measurements VALUES (?, ?)",
+                                  (key, json.dumps(measurements)))
+
+    def stats(self):
+        hits, misses = self.counters[:]
+        return {"hits": hits,
+                "misses": misses,
+                "hitRate": hits / (hits + misses) if hits + misses else 0.0,
+                "entries": len(self.entries)}
+
+
+# The cache calculate_fitness uses in this process, if any
+cache = None
+
+
+# Use this cache in this process; also the pool initializer for the workers.
+def install(fitness_cache):
+    global cache
+    cache = fitness_cache
+
+
+# metrics.metrics(level), going through the installed cache.
+def measure(level):
+    if cache is None:
+        return metrics.metrics(level)
+    key = cache.key(level)
+    measurements = cache.get(key)
+    if measurements is not None:
+        return measurements
+    measurements = metrics.metrics(level)
+    # measurements cut short by a search budget aren't kept, so a later run with more budget redoes them
+    if measurements['searchComplete']:
+        cache.put(key, measurements)
+    return measurements
+
+
+# measure() for a list of levels, measuring all the ones the cache doesn't have
+# with one metrics.metrics_batch call.  Returns their measurements, in order.
+def measure_batch(levels):
+    if cache is None:
+        return metrics.metrics_batch(levels)
+    keys = [cache.key(level) for level in levels]
+    found = [cache.get(key) for key in keys]
+    missing = [i for i, measurements in enumerate(found) if measurements is None]
+    for i, measurements in zip(missing, metrics.metrics_batch([levels[i] for i in missing])):
+        if measurements['searchComplete']:
+            cache.put(keys[i], measurements)
+        found[i] = measurements
+    return found
+
+
+def stats():
+    return cache.stats() if cache is not None else None
@@ -1,16 +1,98 @@
+import argparse
+import checkpoint
+import collections
 import copy
+from design_elements import DesignElements
+import evaluation
+import fitness_cache
 import heapq
+import instrumentation
+import itertools
 import metrics
 import multiprocessing.pool as mpool
+import numpy as np
 import os
+import pickle
+import queue
 import random
+import selection
 import shutil
 import time
 import math
+import tiles
 
 width = 200
 height = 16
 
+# Store Individual_Grid genomes as height x width uint8 arrays of tile codes (see tiles.py)
+# instead of lists of one-character strings.  Copies are a single memcpy and a genome pickles
+# to the pool workers as 3.2 KB instead of thousands of string references.  Individual_DE's
+# to_level returns levels in that form too.
+compact_grid = False
+
+# Measurements are cached by level (see fitness_cache.py), up to cache_size levels per process.
+# Set cache_path to a file to keep them on disk and reuse them in later runs.
+cache_size = 4096
+cache_path = None
+
+# How ga() sends the population to the pool for fitness: "pool" pickles every individual there and
+# back; "shared" (Individual_Grid only) puts the genomes in shared memory and gets back only
+# fitnesses (see evaluation.py).
+evaluation_backend = "pool"
+
+# With the "pool" backend, have each worker measure its whole batch of levels with one
+# metrics.metrics_batch call (see evaluate_batch) rather than one at a time.
+batch_metrics = False
+
+# "generational" breeds a whole population and then evaluates it; "steady_state" keeps every pool
+# worker busy evaluating one child at a time and puts each child back into the population as soon
+# as it is done (see steady_state); "islands" splits the population into islands that each evolve
+# on a worker of their own and swap migrants now and then (see evolve_islands); "fi2pop" is
+# generational with the feasible and infeasible individuals bred separately, and only feasible ones
+# measured by metrics (infeasible ones are scored on metrics.constraintDistance alone).  FI-2POP is
+# for Individual_DE only; Individual_Grid runs fall back to generational.
+ga_mode = "generational"
+
+# Island mode: how many islands (None for one per core), how often they swap migrants (in
+# generations), how many of each island's best emigrate, and where to: "ring" sends them to the
+# next island, "random" to any other.
+islands = None
+migration_interval = 5
+migrants = 2
+migration_topology = "ring"
+
+# In generational runs, breed on the pool too: each worker task takes a pair of parents, breeds it
+# with its own seed and sends back the children with their fitness already calculated.
+parallel_breeding = False
+
+# How generate_successors and steady_state pick parents: one of selection.methods.  The best
+# elitism fraction of each generation also carries over unchanged (steady-state runs only ever
+# replace their worst, so they keep their best anyway).
+selection_method = "tournament"
+elitism = 0.02
+
+# Save the run to checkpoint_path (e.g. "levels/checkpoint.bin"; None, the default, to not bother)
+# every checkpoint_interval generations, so ga(resume=checkpoint_path) or
+# "python ga.py --resume <path>" can carry on from there.
+# Generational, FI-2POP and island runs carry on exactly as they would have; steady-state runs
+# lose the children that were out at the pool.
+checkpoint_path = None
+checkpoint_interval = 1
+
+# Write timings and counts for each generation (see instrumentation.py) to instrumentation_path, a
+# .jsonl or .csv file (None to not bother), and run every profile_every-th generation under
+# cProfile and every trace_every-th under tracemalloc (0 for never).  Worker-side numbers cover
+# generational, FI-2POP and island runs.
+instrumentation_path = None
+profile_every = 0
+trace_every = 0
+
+# The settings a checkpoint records and a resumed run puts back
+run_settings = ["compact_grid", "ga_mode", "parallel_breeding", "selection_method",
+                "elitism", "islands", "migration_interval", "migrants", "migration_topology"]
+# ...and the metrics settings it records, which limit and choose the path searches
+search_settings = ["searchBudget", "searchTimeLimit", "searchKernel"]
+
 options = [
     "-",  # an empty space
     "X",  # a solid wall
@@ -30,16 +112,27 @@ options = [
 
 
 class Individual_Grid(object):
-    __slots__ = ["genome", "_fitness"]
+    __slots__ = ["genome", "_fitness", "_distance"]
+    # How many children generate_children makes
+    children_per_pair = 1
 
     def __init__(self, genome):
-        self.genome = copy.deepcopy(genome)
+        if tiles.is_compact(genome):
+            self.genome = genome.copy()
+        else:
+            self.genome = copy.deepcopy(genome)
         self._fitness = None
+        self._distance = None
 
     # Update this individual's estimate of its fitness.
     # This can be expensive so we do it once and then cache the result.
-    def calculate_fitness(self):
-        measurements = metrics.metrics(self.to_level())
+    # measurements, if given, are the level's already (see evaluate_batch).
+    def calculate_fitness(self, measurements=None):
+        if ga_mode == "fi2pop" and not self.feasible():
+            self._fitness = -self.constraint_distance()
+            return self
+        if measurements is None:
+            measurements = fitness_cache.measure(self.to_level())
         # Print out the possible measurements or look at the implementation of metrics.py for other keys:
         # print(measurements.keys())
         # Default fitness function: Just some arbitrary combination of a few criteria.  Is it good?  Who knows?
@@ -62,12 +155,23 @@ class Individual_Grid(object):
             self.calculate_fitness()
         return self._fitness
 
+    # How far the level is from feasible (metrics.constraintDistance), cached like fitness.
+    def constraint_distance(self):
+        if self._distance is None:
+            self._distance = metrics.constraintDistance(self.to_level())
+        return self._distance
+
+    def feasible(self):
+        return self.constraint_distance() == 0
+
     # Mutate a genome into a new genome.  Note that this is a _genome_, not an individual!
     def mutate(self, genome):
         # STUDENT implement a mutation operator, also consider not mutating this individual
         # STUDENT also consider weighting the different tile types so it's not uniformly random
         # STUDENT consider putting more constraints on this to prevent pipes in the air, etc
         mutation_rate = 1.0
+        if tiles.is_compact(genome):
+            return self.mutate_compact(genome, mutation_rate)
 
         left = 1
         right = width - 1
@@ -122,75 +226,182 @@ class Individual_Grid(object):
 
         return genome
 
+    # The same rules as mutate, for compact genomes, applied to every cell at once.
+    # All the random numbers are drawn up front and each rule becomes a boolean mask.  Every
+    # rule looks at the genome as it was before mutation, whereas the loop above sees the
+    # edits it has already made earlier in the scan; the per-cell probabilities are the same.
+    def mutate_compact(self, genome, mutation_rate=1.0):
+        rng = np.random.default_rng(random.getrandbits(64))
+        u = rng.random((10, height, width))
+        g = genome
+        rows = np.arange(height)[:, None]
+        cols = np.arange(width)[None, :]
+        inner = (cols >= 1) & (cols < width - 1)
+
+        def shifted(dy, dx):
+            # shifted(dy, dx)[y, x] is g[y + dy, x + dx], or 255 (no tile) off the edge of the level
+            out = np.full_like(g, 255)
+            out[max(0, -dy):height - max(0, dy), max(0, -dx):width - max(0, dx)] = \
+                g[max(0, dy):height + min(0, dy), max(0, dx):width + min(0, dx)]
+            return out
+
+        empty = g == tiles.EMPTY
+        below = shifted(1, 0)
+        right_tile = shifted(0, 1)
+        left_tile = shifted(0, -1)
+        # genome[y - 1] wraps around to the bottom row in the loop version
+        above = np.roll(g, 1, axis=0)
+        below_empty = ((below == tiles.EMPTY) &
+                       (shifted(1, 1) == tiles.EMPTY) &
+                       (shifted(1, -1) == tiles.EMPTY))
+        block = (g == tiles.BREAKABLE) | (g == tiles.MUSHROOM) | (g == tiles.QBLOCK)
+
+        # block type swap, 20%
+        swap = inner & block & (u[0] < 0.2 * mutation_rate)
+        # coin or enemy above a block, 3%; the rest of the empty-space rules only get a chance if this one doesn't fire
+        tried_above = inner & empty & (u[1] < 0.03 * mutation_rate)
+        above_block = tried_above & ((below == tiles.BREAKABLE) | (below == tiles.WALL))
+        # coin or enemy removal, 1%
+        remove = inner & ((g == tiles.COIN) | (g == tiles.ENEMY)) & (u[2] < 0.01 * mutation_rate)
+        # breakable block high above empty space, more likely the higher up
+        grow = (inner & empty & ~tried_above &
+                (u[3] < (0.01 - (0.01 * (height - rows) / height)) * mutation_rate) &
+                (height - rows > 4) & below_empty)
+        # breakable block next to another one, 1%
+        extend = (inner & empty & ~tried_above & ~grow &
+                  (u[4] < 0.01 * mutation_rate) &
+                  ((right_tile == tiles.BREAKABLE) | (left_tile == tiles.BREAKABLE)) & below_empty)
+        # breakable block removal, 1% increasing to 5% with height
+        unbreak = inner & (g == tiles.BREAKABLE) & (u[5] < (0.01 + (0.04 * (height - rows) / height)) * mutation_rate)
+        # ground erosion, 2%, sometimes taking its neighbours with it
+        erode = inner & (g == tiles.WALL) & (above == tiles.EMPTY) & (u[6] < 0.02 * mutation_rate)
+        widen = (erode & (u[7] < 0.25 * mutation_rate) &
+                 (left_tile == tiles.WALL) & (right_tile == tiles.WALL) &
+                 (cols - 1 > 0) & (cols + 1 < width - 1))
+
+        new_genome = g.copy()
+        new_genome[swap] = np.where(u[8] < 0.7, tiles.BREAKABLE,
+                                    np.where(u[8] < 0.9, tiles.QBLOCK, tiles.MUSHROOM))[swap]
+        new_genome[above_block] = np.where(u[9] < 0.7, tiles.COIN, tiles.ENEMY)[above_block]
+        new_genome[remove] = tiles.EMPTY
+        new_genome[grow | extend] = tiles.BREAKABLE
+        new_genome[unbreak | erode] = tiles.EMPTY
+        widen_y, widen_x = np.nonzero(widen)
+        new_genome[widen_y, widen_x - 1] = tiles.EMPTY
+        new_genome[widen_y, widen_x + 1] = tiles.EMPTY
+        return new_genome
+
     # Create zero or more children from self and other
     def generate_children(self, other):
-        new_genome = copy.deepcopy(self.genome)
+        start = time.perf_counter()
+        new_genome = self.crossover(other)
+        crossed = time.perf_counter()
+        # do mutation; note we're returning a one-element tuple here
+        new_genome = self.mutate(new_genome)
+        instrumentation.add("crossover", crossed - start)
+        instrumentation.add("mutation", time.perf_counter() - crossed)
+        return (Individual_Grid(new_genome),)
+
+    # Cross this individual's genome with other's into a new genome.
+    # The pipe and brick limits are kept as running counts, and the empty-space checks under a
+    # new pipe use the lowest filled row of each column, so this is linear in the level size.
+    # It makes the same random calls in the same order as a plain rescan of new_genome would,
+    # so a fixed RNG stream gives the same child for lists of strings and compact genomes alike.
+    def crossover(self, other):
+        compact = tiles.is_compact(self.genome)
+        if compact:
+            mine = self.genome.tolist()
+            theirs = other.genome.tolist()
+            EMPTY, BRICK, PIPE, PIPE_TOP = tiles.EMPTY, tiles.BREAKABLE, tiles.PIPE, tiles.PIPE_TOP
+            forbidden = (tiles.FLAGPOLE, tiles.FLAG, tiles.START)
+        else:
+            mine = self.genome
+            theirs = other.genome
+            EMPTY, BRICK, PIPE, PIPE_TOP = "-", "B", "|", "T"
+            forbidden = ("v", "f", "m")
+        new_genome = [row[:] for row in mine]
         # Leaving first and last columns alone...
         # do crossover with other
         left = 1
         right = width - 1
+        threshold = 5
+        pipeMax = 10
+        # fitness() is cached, so asking once up front doesn't change anything
+        self_fitness = self.fitness()
+        other_fitness = other.fitness()
+
+        pipes = sum(row.count(PIPE_TOP) for row in new_genome)
+        column_B = [sum(1 for row in new_genome if row[x] == BRICK) for x in range(width)]
+        # the lowest row above the floor that isn't empty space, per column (-1 if there isn't one)
+        lowest = [max([y for y in range(height - 1) if new_genome[y][x] != EMPTY], default=-1)
+                  for x in range(width)]
+
+        # Crossover only ever fills cells, so lowest can only move down.
+        def place(y, x, tile):
+            nonlocal pipes
+            old = new_genome[y][x]
+            pipes += (tile == PIPE_TOP) - (old == PIPE_TOP)
+            column_B[x] += (tile == BRICK) - (old == BRICK)
+            if tile != EMPTY and lowest[x] < y < height - 1:
+                lowest[x] = y
+            new_genome[y][x] = tile
+
+        # all(new_genome[dy][c] == "-" for dy in range(y + 2, height - 1)) for c in x - 1, x, x + 1
+        def clear_below(y, x):
+            return lowest[x - 1] < y + 2 and lowest[x] < y + 2 and lowest[x + 1] < y + 2
+
+        def add_pipe(y, x):
+            place(y, x, PIPE_TOP)
+            for dy in range(y + 1, height - 1):
+                place(dy, x, PIPE)
+
         for y in range(height - 1, 0, -1):
             for x in range(left, right):
                 # STUDENT Which one should you take?  Self, or other?  Why?
                 # STUDENT consider putting more constraints on this to prevent pipes in the air, etc
-                threshold = 5
-                pipeMax = 10
 
                 # 5% chance to add a pipe
                 if height - y < threshold and random.random() < 0.05:
                     # take highest fitness pipe or 20% chance to take lower fitness a pipe
-                    if (self.genome[y][x] == "T" and
-                        (self.fitness() < other.fitness() or random.random() < 0.20) and
-                        all(new_genome[dy][x] == "-" for dy in range(y+2, height - 1)) and
-                        all(new_genome[dy][x + 1] == "-" for dy in range(y+2, height - 1)) and
-                        all(new_genome[dy][x - 1] == "-" for dy in range(y+2, height - 1)) and
-                        sum(row.count("T") for row in new_genome) < pipeMax):
-
-                        # add whole pipe
-                        new_genome[y][x] = "T"
-                        for dy in range(y+1, height - 1):
-                            new_genome[dy][x] = "|"  
+                    if (mine[y][x] == PIPE_TOP and
+                        (self_fitness < other_fitness or random.random() < 0.20) and
+                        clear_below(y, x) and
+                        pipes < pipeMax):
+                        add_pipe(y, x)
 
                     # take highest fitness pipe
-                    elif (other.genome[y][x] == "T" and
-                        other.fitness() < self.fitness() and
-                        all(new_genome[dy][x] == "-" for dy in range(y+2, height - 1)) and
-                        all(new_genome[dy][x + 1] == "-" for dy in range(y+2, height - 1)) and
-                        all(new_genome[dy][x - 1] == "-" for dy in range(y+2, height - 1)) and
-                        sum(row.count("T") for row in new_genome) < pipeMax):
-
-                        # add whole pipe
-                        new_genome[y][x] = "T"
-                        for dy in range(y+1, height - 1):
-                            new_genome[dy][x] = "|"  
+                    elif (theirs[y][x] == PIPE_TOP and
+                        other_fitness < self_fitness and
+                        clear_below(y, x) and
+                        pipes < pipeMax):
+                        add_pipe(y, x)
 
                 # if equal to threshold hight and a parent has a brick, add a brick 
-                if height - y == threshold and (self.genome[y][x] == "B" or other.genome[y][x] == "B"):
-                    count_B = sum(1 for row in new_genome if row[x] == "B")
+                if height - y == threshold and (mine[y][x] == BRICK or theirs[y][x] == BRICK):
+                    count_B = column_B[x]
                     # 15% have brick on tile, but less likely as number of bricks increases
                     if random.random() < 0.15 - (0.15 * (2 * count_B / width)):
-                        new_genome[y][x] = "B"
+                        place(y, x, BRICK)
                         if random.random() < 0.3:  # 30% chance to place another block
                             offset_x = random.choice([-1, 1])  # left, or right
                             offset_y = random.randint(3, 5)  # between 3 and 5 blocks higher
                             new_x = clip(left, x + offset_x, right - 1)
                             new_y = clip(0, y - offset_y, height - 1)
-                            if new_genome[new_y][new_x] == "-":
-                                new_genome[new_y][new_x] = "B"
+                            if new_genome[new_y][new_x] == EMPTY:
+                                place(new_y, new_x, BRICK)
                         elif random.random() < 0.3:  # 30% chance to place block to either side
                             offset_x = random.choice([-1, 1])  # left, or right
                             new_x = clip(left, x + offset_x, right - 1)
-                            if new_genome[y][new_x] == "-":
-                                new_genome[y][new_x] = "B"
+                            if new_genome[y][new_x] == EMPTY:
+                                place(y, new_x, BRICK)
 
                 # don't change the forbidden tiles
-                if self.genome[y][x] == "v" or self.genome[y][x] == "f" or self.genome[y][x] == "m":
-                    new_genome[y][x] = self.genome[y][x]
-                    
-        new_genome = self.mutate(new_genome)
+                if mine[y][x] in forbidden:
+                    place(y, x, mine[y][x])
 
-        # do mutation; note we're returning a one-element tuple here
-        return (Individual_Grid(new_genome),)
+        if compact:
+            return np.array(new_genome, dtype=np.uint8)
+        return new_genome
 
     # Turn the genome into a level string (easy for this genome)
     def to_level(self):
@@ -208,6 +419,8 @@ class Individual_Grid(object):
             g[col][-2] = "f"
         for col in range(14, 16):
             g[col][-2] = "X"
+        if compact_grid:
+            g = tiles.encode(g)
         return cls(g)
 
     @classmethod
@@ -218,8 +431,12 @@ class Individual_Grid(object):
         g[15][:] = ["X"] * width
         g[14][0] = "m"
         g[7][-2] = "v"
-        g[8:14][-2] = ["f"] * 6
-        g[14:16][-2] = ["X", "X"]
+        for col in range(8, 14):
+            g[col][-2] = "f"
+        for col in range(14, 16):
+            g[col][-2] = "X"
+        if compact_grid:
+            g = tiles.encode(g)
         return cls(g)
 
 
@@ -239,23 +456,119 @@ def clip(lo, val, hi):
         return hi
     return val
 
+
+# The empty level Individual_DE paints its design elements onto, as tile codes.  Read-only.
+base_template = tiles.encode(Individual_Grid.empty_individual().genome)
+base_template.setflags(write=False)
+
+
+# The first and last column a design element can paint.
+def de_columns(de):
+    x = de[0]
+    de_type = de[1]
+    if de_type == "0_hole":
+        return clip(1, x, width - 2), clip(1, x + de[2] - 1, width - 2)
+    elif de_type == "6_stairs":
+        return clip(1, x + 1, width - 2), clip(1, x + de[2], width - 2)
+    elif de_type == "1_platform":
+        return clip(1, x, width - 2), clip(1, x + de[2] - 1, width - 2)
+    return x % width, x % width
+
+
+# Paint one design element onto a level of tile codes.
+def paint_de(level, de):
+    # de: x, type, ...
+    x = de[0]
+    de_type = de[1]
+    if de_type == "4_block":
+        y = de[2]
+        breakable = de[3]
+        level[y, x] = tiles.BREAKABLE if breakable else tiles.WALL
+    elif de_type == "5_qblock":
+        y = de[2]
+        has_powerup = de[3]  # boolean
+        level[y, x] = tiles.MUSHROOM if has_powerup else tiles.QBLOCK
+    elif de_type == "3_coin":
+        y = de[2]
+        level[y, x] = tiles.COIN
+    elif de_type == "7_pipe":
+        h = de[2]
+        level[height - h - 1, x] = tiles.PIPE_TOP
+        level[np.arange(height - h, height), x] = tiles.PIPE
+    elif de_type == "0_hole":
+        w = de[2]
+        level[height - 1, np.clip(x + np.arange(w), 1, width - 2)] = tiles.EMPTY
+    elif de_type == "6_stairs":
+        h = de[2]
+        dx = de[3]  # -1 or 1
+        for x2 in range(1, h + 1):
+            steps = x2 if dx == 1 else h - x2
+            if steps > 0:
+                level[max(0, height - steps):, clip(1, x + x2, width - 2)] = tiles.WALL
+    elif de_type == "1_platform":
+        w = de[2]
+        h = de[3]
+        madeof = de[4]  # from "?", "X", "B"
+        level[clip(0, height - h - 1, height - 1), np.clip(x + np.arange(w), 1, width - 2)] = tiles.tile_codes[madeof]
+    elif de_type == "2_enemy":
+        level[height - 2, x] = tiles.ENEMY
+
+
+# Paint design elements onto a level, in the order that decides which of two overlapping ones wins.
+def paint(level, genome):
+    for de in sorted(genome, key=lambda de: (de[1], de[0], de)):
+        paint_de(level, de)
+    return level
+
+
+# The level of genome, made from parent_level (the level of parent_genome) by repainting only the
+# columns a design element was added to or taken from.  None if that is most of the level.
+def repaint(parent_genome, parent_level, genome):
+    changed = collections.Counter(genome)
+    changed.subtract(parent_genome)
+    dirty = np.zeros(width, dtype=bool)
+    for de, difference in changed.items():
+        if difference:
+            lo, hi = de_columns(de)
+            dirty[lo:hi + 1] = True
+    if dirty.sum() > width // 2:
+        return None
+    level = parent_level.copy()
+    if dirty.any():
+        # everything that touches those columns, painted in the usual order
+        touching = []
+        for de in genome:
+            lo, hi = de_columns(de)
+            if dirty[lo:hi + 1].any():
+                touching.append(de)
+        level[:, dirty] = paint(base_template.copy(), touching)[:, dirty]
+    return level
+
 # Inspired by https://www.researchgate.net/profile/Philippe_Pasquier/publication/220867545_Towards_a_Generic_Framework_for_Automated_Video_Game_Level_Creation/links/0912f510ac2bed57d1000000.pdf
 
 
 class Individual_DE(object):
     # Calculating the level isn't cheap either so we cache it too.
-    __slots__ = ["genome", "_fitness", "_level"]
+    __slots__ = ["genome", "_fitness", "_level", "_distance", "_parent"]
+    # How many children generate_children usually makes (one if a parent is empty)
+    children_per_pair = 2
 
-    # Genome is a heapq of design elements sorted by X, then type, then other parameters
+    # Genome is a DesignElements of design elements sorted by X, then type, then other parameters
     def __init__(self, genome):
-        self.genome = list(genome)
-        heapq.heapify(self.genome)
+        self.genome = DesignElements(genome)
         self._fitness = None
         self._level = None
+        self._distance = None
+        # Until the level is rendered, a parent's (genome, level) to render it from (if any)
+        self._parent = None
 
-    # Calculate and cache fitness
-    def calculate_fitness(self):
-        measurements = metrics.metrics(self.to_level())
+    # Calculate and cache fitness, from measurements if they're given (see evaluate_batch)
+    def calculate_fitness(self, measurements=None):
+        if ga_mode == "fi2pop" and not self.feasible():
+            self._fitness = -self.constraint_distance()
+            return self
+        if measurements is None:
+            measurements = fitness_cache.measure(self.render())
         # Default fitness function: Just some arbitrary combination of a few criteria.  Is it good?  Who knows?
         # STUDENT Add more metrics?
         # STUDENT Improve this with any code you like
@@ -269,9 +582,8 @@ class Individual_DE(object):
         )
         penalties = 0
         # STUDENT For example, too many stairs are unaesthetic.  Let's penalize that
-        if len(list(filter(lambda de: de[1] == "6_stairs", self.genome))) > 5:
+        if self.genome.count("6_stairs") > 5:
             penalties -= 2
-        # STUDENT If you go for the FI-2POP extra credit, you can put constraint calculation in here too and cache it in a new entry in __slots__.
         self._fitness = sum(map(lambda m: coefficients[m] * measurements[m],
                                 coefficients)) + penalties
         return self
@@ -281,6 +593,15 @@ class Individual_DE(object):
             self.calculate_fitness()
         return self._fitness
 
+    # How far the level is from feasible (metrics.constraintDistance), cached like fitness.
+    def constraint_distance(self):
+        if self._distance is None:
+            self._distance = metrics.constraintDistance(self.render())
+        return self._distance
+
+    def feasible(self):
+        return self.constraint_distance() == 0
+
     def mutate(self, new_genome):
         # STUDENT How does this work?  Explain it in your writeup.
         # STUDENT consider putting more constraints on this, to prevent generating weird things
@@ -379,8 +700,7 @@ class Individual_DE(object):
             elif de_type == "2_enemy":
                 x = offset_by_upto(x, width / 8, min=1, max=width - 2)
                 new_de = (x, de_type)
-            new_genome.pop(to_change)
-            heapq.heappush(new_genome, new_de)
+            new_genome.replace(to_change, new_de)
         return new_genome
 
     def generate_children(self, other):
@@ -388,6 +708,7 @@ class Individual_DE(object):
         if len(self.genome) == 0 or len(other.genome) == 0:
             return (Individual_DE.random_individual(),)  # Replace empty individuals
 
+        start = time.perf_counter()
         pa = random.randint(0, len(self.genome) - 1)
         pb = random.randint(0, len(other.genome) - 1)
         a_part = self.genome[:pa] if len(self.genome) > 0 else []
@@ -396,54 +717,34 @@ class Individual_DE(object):
         b_part = other.genome[:pb] if len(other.genome) > 0 else []
         a_part = self.genome[pa:] if len(self.genome) > 0 else []
         gb = b_part + a_part
+        crossed = time.perf_counter()
         # do mutation
-        return Individual_DE(self.mutate(ga)), Individual_DE(self.mutate(gb))
+        children = Individual_DE(self.mutate(DesignElements(ga))), Individual_DE(self.mutate(DesignElements(gb)))
+        instrumentation.add("crossover", crossed - start)
+        instrumentation.add("mutation", time.perf_counter() - crossed)
+        for child, parent in zip(children, (self, other)):
+            if parent._level is not None:
+                child._parent = (parent.genome, parent._level)
+        return children
 
-    # Apply the DEs to a base level.
-    def to_level(self):
+    # The level as a height x width array of tile codes, painted once and cached.  A child of an
+    # already-rendered parent only repaints the columns its design elements differ in.
+    def render(self):
         if self._level is None:
-            base = Individual_Grid.empty_individual().to_level()
-            for de in sorted(self.genome, key=lambda de: (de[1], de[0], de)):
-                # de: x, type, ...
-                x = de[0]
-                de_type = de[1]
-                if de_type == "4_block":
-                    y = de[2]
-                    breakable = de[3]
-                    base[y][x] = "B" if breakable else "X"
-                elif de_type == "5_qblock":
-                    y = de[2]
-                    has_powerup = de[3]  # boolean
-                    base[y][x] = "M" if has_powerup else "?"
-                elif de_type == "3_coin":
-                    y = de[2]
-                    base[y][x] = "o"
-                elif de_type == "7_pipe":
-                    h = de[2]
-                    base[height - h - 1][x] = "T"
-                    for y in range(height - h, height):
-                        base[y][x] = "|"
-                elif de_type == "0_hole":
-                    w = de[2]
-                    for x2 in range(w):
-                        base[height - 1][clip(1, x + x2, width - 2)] = "-"
-                elif de_type == "6_stairs":
-                    h = de[2]
-                    dx = de[3]  # -1 or 1
-                    for x2 in range(1, h + 1):
-                        for y in range(x2 if dx == 1 else h - x2):
-                            base[clip(0, height - y - 1, height - 1)][clip(1, x + x2, width - 2)] = "X"
-                elif de_type == "1_platform":
-                    w = de[2]
-                    h = de[3]
-                    madeof = de[4]  # from "?", "X", "B"
-                    for x2 in range(w):
-                        base[clip(0, height - h - 1, height - 1)][clip(1, x + x2, width - 2)] = madeof
-                elif de_type == "2_enemy":
-                    base[height - 2][x] = "E"
-            self._level = base
+            level = None
+            if self._parent is not None:
+                level = repaint(self._parent[0], self._parent[1], self.genome)
+            if level is None:
+                level = paint(base_template.copy(), self.genome)
+            self._level = level
+            self._parent = None
         return self._level
 
+    # Apply the DEs to a base level.
+    def to_level(self):
+        level = self.render()
+        return level if compact_grid else tiles.decode(level)
+
     @classmethod
     def empty_individual(_cls):
         # STUDENT Maybe enhance this
@@ -475,112 +776,378 @@ class Individual_DE(object):
 Individual = Individual_DE
 
 
-def generate_successors(population):
-    results = []
+# Pick count pairs of parents from population.
+def parent_pairs(population, count):
+    start = time.perf_counter()
+    parents = selection.methods[selection_method](population, 2 * count)
+    instrumentation.add("selection", time.perf_counter() - start)
+    return list(zip(parents[0::2], parents[1::2]))
+
+
+# Breed pairs in this process, returning all their children.
+def breed_serial(pairs):
+    return [child for parent1, parent2 in pairs for child in parent1.generate_children(parent2)]
+
+
+# Worker side of breed_parallel: breed one pair with its own seed and calculate the children's
+# fitness before they go back.
+def breed_pair(task):
+    parent1, parent2, seed = task
+    random.seed(seed)
+    children = parent1.generate_children(parent2)
+    start = time.perf_counter()
+    children = [child.calculate_fitness() for child in children]
+    instrumentation.add("evaluation", time.perf_counter() - start)
+    return children
+
+
+# Breed and evaluate pairs on the pool.  Each pair gets a seed from this process's RNG, so a run
+# is reproducible whatever worker a pair lands on.
+def breed_parallel(pool, pairs, batches):
+    tasks = [(parent1, parent2, random.getrandbits(64)) for parent1, parent2 in pairs]
+    chunk_size = int(math.ceil(len(tasks) / batches))
+    if instrumentation.enabled:
+        bred = instrumentation.pool_map(pool, breed_pair, tasks, chunk_size)
+    else:
+        bred = pool.map(breed_pair, tasks, chunk_size)
+    return [child for children in bred for child in children]
+
+
+def generate_successors(population, breed=breed_serial):
     # STUDENT Design and implement this
     # Hint: Call generate_children() on some individuals and fill up results.
-    valid_population = [ind for ind in population if len(ind.genome) > 0]
-    # If too few valid individuals, regenerate some random ones
-    while len(valid_population) < len(population) // 2:
-        valid_population.append(Individual_DE.random_individual())
-
-    # Generate children from the top individuals
-    num_parents = len(population) // 2
-    for i in range(num_parents - int(num_parents * 0.1)):
-        parent1 = population[i]
-        parent2 = population[num_parents + i]
-        children = parent1.generate_children(parent2)
-        results.extend(children)
-
-    # Roulette wheel selection
-    total_fitness = sum(ind.fitness() for ind in population)
-    if total_fitness > 0:
-        selection_probs = [ind.fitness() / total_fitness for ind in population]
-        selected_indices = random.choices(range(len(population)), weights=selection_probs, k=len(population) - len(results))
-        for i in selected_indices:
-            parent1 = population[i]
-            parent2 = random.choice(population)
-            children = parent1.generate_children(parent2)
-            results.extend(children)
-    
-    # Ensure the results length is equal to the population length
+    # The elite are already evaluated, so evaluate() and the breed functions leave them be
+    results = selection.elite(population, int(len(population) * elitism))
+    # Ask for enough pairs to fill the population, and again if some gave fewer children than usual
     while len(results) < len(population):
-        parent1 = random.choice(population[:num_parents])
-        parent2 = random.choice(population[:num_parents])
-        children = parent1.generate_children(parent2)
-        results.extend(children)
-    
-    results = results[:len(population)]
+        missing = len(population) - len(results)
+        pairs = parent_pairs(population, int(math.ceil(missing / type(population[0]).children_per_pair)))
+        results.extend(breed(pairs))
+    return results[:len(population)]
+
+
+# Calculate the fitness of everyone in population in parallel, through evaluator if there is one.
+# Individuals whose fitness is already known are passed through.
+def evaluate(pool, population, batch_size, evaluator=None):
+    start = time.perf_counter()
+    fresh = [individual._fitness is None for individual in population]
+    pending = [individual for individual, is_fresh in zip(population, fresh) if is_fresh]
+    if evaluator is not None:
+        evaluated = iter(evaluator.evaluate(pool, pending))
+    elif batch_metrics:
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        if instrumentation.enabled:
+            batches = instrumentation.pool_map(pool, evaluate_batch, batches)
+        else:
+            batches = pool.map(evaluate_batch, batches, 1)
+        evaluated = iter([individual for batch in batches for individual in batch])
+    elif instrumentation.enabled:
+        evaluated = iter(evaluate_instrumented(pool, pending, batch_size))
+    else:
+        evaluated = iter(pool.map(Individual.calculate_fitness, pending, batch_size))
+    population = [next(evaluated) if is_fresh else individual for individual, is_fresh in zip(population, fresh)]
+    instrumentation.add("evaluation_wall", time.perf_counter() - start)
+    return population
+
 
-    return results
+# Worker side of evaluate() with batch_metrics: render the batch, measure all its levels at once
+# through fitness_cache.measure_batch and score each individual on its measurements.  In FI-2POP
+# runs the infeasible ones are left out and scored on their constraint distance as usual.
+def evaluate_batch(batch):
+    measured = [individual for individual in batch if ga_mode != "fi2pop" or individual.feasible()]
+    start = time.perf_counter()
+    levels = [getattr(individual, "render", individual.to_level)() for individual in measured]
+    rendered = time.perf_counter()
+    for individual, measurements in zip(measured, fitness_cache.measure_batch(levels)):
+        individual.calculate_fitness(measurements)
+    for individual in batch:
+        if individual._fitness is None:
+            individual.calculate_fitness()
+    instrumentation.add("rendering", rendered - start)
+    instrumentation.add("evaluation", time.perf_counter() - rendered)
+    return batch
 
 
-def ga():
+# evaluate() when instrumenting: the batches are pickled here rather than inside the pool, so
+# the time it takes can be counted.
+def evaluate_instrumented(pool, population, batch_size):
+    start = time.perf_counter()
+    payloads = [pickle.dumps(population[i:i + batch_size], pickle.HIGHEST_PROTOCOL)
+                for i in range(0, len(population), batch_size)]
+    instrumentation.add("pickling", time.perf_counter() - start)
+    payloads = instrumentation.pool_map(pool, evaluate_pickled, payloads)
+    start = time.perf_counter()
+    evaluated = [individual for payload in payloads for individual in pickle.loads(payload)]
+    instrumentation.add("pickling", time.perf_counter() - start)
+    return evaluated
+
+
+# Worker side of evaluate_instrumented: unpickle a batch, render and measure each individual,
+# and pickle them back, timing each part.
+def evaluate_pickled(payload):
+    start = time.perf_counter()
+    batch = pickle.loads(payload)
+    instrumentation.add("pickling", time.perf_counter() - start)
+    for individual in batch:
+        start = time.perf_counter()
+        getattr(individual, "render", individual.to_level)()
+        rendered = time.perf_counter()
+        individual.calculate_fitness()
+        done = time.perf_counter()
+        instrumentation.add("rendering", rendered - start)
+        instrumentation.add("evaluation", done - rendered)
+        instrumentation.sample("evaluation", done - start)
+    start = time.perf_counter()
+    payload = pickle.dumps(batch, pickle.HIGHEST_PROTOCOL)
+    instrumentation.add("pickling", time.perf_counter() - start)
+    return payload
+
+
+# The fitness of an entry in steady_state's population heap, for selection.
+def entry_fitness(entry):
+    return entry[0]
+
+
+# Steady-state evolution: keep in_flight children out at the pool at all times and, as each one
+# comes back, let it replace the worst individual in the population if it beats it, then breed and
+# send out the next.  Breeding overlaps evaluation and no one waits on the slowest batch.  Calls
+# report(population, generation) every len(population) children and returns the population once
+# evaluations children have come back.
+def steady_state(pool, population, evaluations, in_flight, report=None):
+    finished = queue.SimpleQueue()
+    # The population as a min-heap of (fitness, tiebreak, individual), so ranked[0] is the worst
+    ranked = [(individual.fitness(), i, individual) for i, individual in enumerate(population)]
+    heapq.heapify(ranked)
+    tiebreak = itertools.count(len(ranked))
+    submitted = 0
+    outstanding = 0
+    done = 0
+    while done < evaluations:
+        while outstanding < in_flight and submitted < evaluations:
+            parent1, parent2 = selection.methods[selection_method](ranked, 2, key=entry_fitness)
+            children = parent1[2].generate_children(parent2[2])
+            for child in children[:evaluations - submitted]:
+                pool.apply_async(Individual.calculate_fitness, (child,),
+                                 callback=finished.put, error_callback=finished.put)
+                submitted += 1
+                outstanding += 1
+        child = finished.get()
+        if isinstance(child, BaseException):
+            raise child
+        outstanding -= 1
+        done += 1
+        if child.fitness() > ranked[0][0]:
+            heapq.heapreplace(ranked, (child.fitness(), next(tiebreak), child))
+        if report is not None and done % len(ranked) == 0:
+            report([entry[2] for entry in ranked], done // len(ranked))
+    return [entry[2] for entry in ranked]
+
+
+# Worker side of evolve_islands: evolve one island for some generations, all in this process.
+def evolve_island(task):
+    population, generations, seed = task
+    random.seed(seed)
+    for _generation in range(generations):
+        population = [individual if individual._fitness is not None else individual.calculate_fitness()
+                      for individual in generate_successors(population)]
+    return population
+
+
+# Send each island's count best individuals to another island, where they replace the worst.
+def migrate(populations, count, topology):
+    incoming = [[] for _island in populations]
+    for source, island in enumerate(populations):
+        if topology == "ring":
+            destination = (source + 1) % len(populations)
+        else:
+            destination = random.choice([i for i in range(len(populations)) if i != source])
+        incoming[destination].extend(selection.elite(island, count))
+    for island, arrivals in zip(populations, incoming):
+        worst = heapq.nsmallest(len(arrivals), range(len(island)), key=lambda i: island[i].fitness())
+        for i, arrival in zip(worst, arrivals):
+            island[i] = arrival
+
+
+# Island model: split population into count islands and evolve each one on the pool for
+# migration_interval generations at a time, with a migration in between.  The only
+# synchronization is once per interval rather than once per generation.  Calls
+# report(population, generation) after each interval and returns the whole population.
+def evolve_islands(pool, population, generations, count, report=None):
+    # contiguous, so splitting a population evolve_islands returned gives back the same islands
+    populations = [population[len(population) * i // count:len(population) * (i + 1) // count]
+                   for i in range(count)]
+    generation = 0
+    while generation < generations:
+        interval = min(migration_interval, generations - generation)
+        tasks = [(island, interval, random.getrandbits(64)) for island in populations]
+        if instrumentation.enabled:
+            populations = instrumentation.pool_map(pool, evolve_island, tasks)
+        else:
+            populations = pool.map(evolve_island, tasks, 1)
+        generation += interval
+        if count > 1:
+            migrate(populations, migrants, migration_topology)
+        if report is not None:
+            report([individual for island in populations for individual in island], generation)
+    return [individual for island in populations for individual in island]
+
+
+# Which individual is better: by fitness, except that under FI-2POP any feasible individual beats
+# every infeasible one.
+def merit(individual):
+    return (ga_mode != "fi2pop" or individual.feasible(), individual.fitness())
+
+
+# Pool initializer: put this run's settings (run_settings and metrics' search_settings, as they
+# stand once ga() has settled them) into the worker's copies of these modules, turn
+# instrumentation on or off, and install the fitness cache.  Workers that were spawned rather
+# than forked would otherwise only have the defaults from the top of each file.
+def initialize_worker(settings, searches, instrumented, cache):
+    globals().update(settings)
+    vars(metrics).update(searches)
+    instrumentation.enabled = instrumented
+    fitness_cache.install(cache)
+
+
+def ga(resume=None):
+    global Individual, ga_mode
     # STUDENT Feel free to play with this parameter
     pop_limit = 480
+    # STUDENT Determine stopping condition
+    generations = 6
+    state = None
+    if resume is not None:
+        state = checkpoint.load(resume)
+        globals().update(state["settings"])
+        vars(metrics).update(state.get("search_settings", {}))
+        Individual = globals()[state["individual"]]
+        pop_limit = len(state["population"])
     # Code to parallelize some computations
     batches = os.cpu_count()
     if pop_limit % batches != 0:
         print("It's ideal if pop_limit divides evenly into " + str(batches) + " batches.")
     batch_size = int(math.ceil(pop_limit / batches))
-    with mpool.Pool(processes=os.cpu_count()) as pool:
-        init_time = time.time()
-        # STUDENT (Optional) change population initialization
-        population = [Individual.random_individual() if random.random() < 0.9
-                      else Individual.empty_individual()
-                      for _g in range(pop_limit)]
-        # But leave this line alone; we have to reassign to population because we get a new population that has more cached stuff in it.
-        population = pool.map(Individual.calculate_fitness,
-                              population,
-                              batch_size)
-        init_done = time.time()
-        print("Created and calculated initial population statistics in:", init_done - init_time, "seconds")
-        generation = 0
+    instrumentation.enabled = instrumentation_path is not None
+    cache = fitness_cache.FitnessCache(cache_size, cache_path)
+    fitness_cache.install(cache)
+    # No Individual_Grid operator takes a tile away, so its floating pipes could never be fixed
+    if ga_mode == "fi2pop" and Individual is Individual_Grid:
+        print("FI-2POP only works with Individual_DE; running generational instead.")
+        ga_mode = "generational"
+    evaluator = None
+    if evaluation_backend == "shared":
+        if Individual is Individual_Grid and ga_mode == "generational":
+            # made before the pool so the workers can share its memory blocks
+            evaluator = evaluation.SharedEvaluator(Individual, (height, width), batches)
+        else:
+            print("The shared evaluation backend only works with generational Individual_Grid runs; using the pool.")
+    settings = {name: globals()[name] for name in run_settings}
+    searches = {name: vars(metrics)[name] for name in search_settings}
+    with mpool.Pool(processes=os.cpu_count(), initializer=initialize_worker,
+                    initargs=(settings, searches, instrumentation.enabled, cache)) as pool:
+        if state is None:
+            init_time = time.time()
+            # STUDENT (Optional) change population initialization
+            population = [Individual.random_individual() if random.random() < 0.9
+                          else Individual.empty_individual()
+                          for _g in range(pop_limit)]
+            # But leave this line alone; we have to reassign to population because we get a new population that has more cached stuff in it.
+            population = evaluate(pool, population, batch_size, evaluator)
+            init_done = time.time()
+            print("Created and calculated initial population statistics in:", init_done - init_time, "seconds")
+            first_generation = 0
+        else:
+            population = state["population"]
+            first_generation = state["generation"]
+            random.setstate(state["random"])
+            print("Resumed from", resume, "at generation", first_generation)
+        checkpointer = checkpoint.Checkpointer(checkpoint_path) if checkpoint_path is not None else None
+        recorder = None
+        if instrumentation.enabled:
+            recorder = instrumentation.Recorder(instrumentation_path, profile_every, trace_every, cache.stats,
+                                                first_generation + 1)
         start = time.time()
-        now = start
+
+        # Print out statistics
+        def report(population, generation):
+            now = time.time()
+            best = max(population, key=merit)
+            print("Generation:", str(generation))
+            print("Max fitness:", str(best.fitness()))
+            print("Average generation time:", (now - start) / (generation - first_generation))
+            print("Net time:", now - start)
+            print("Fitness cache hit rate:", cache.stats()["hitRate"])
+            with open("levels/last.txt", 'w+') as f:
+                for row in tiles.rows(best.to_level()):
+                    f.write(row + "\n")
+            if checkpointer is not None and generation % checkpoint_interval == 0:
+                checkpointer.save({"settings": settings,
+                                   "search_settings": searches,
+                                   "individual": Individual.__name__,
+                                   "generation": generation,
+                                   "population": population,
+                                   "random": random.getstate()})
+            if recorder is not None:
+                recorder.record(generation)
+
+        # The same, for the modes that count generations from 0 again
+        def report_from_first(population, generation):
+            report(population, first_generation + generation)
+
         print("Use ctrl-c to terminate this loop manually.")
         try:
-            while True:
-                now = time.time()
-                # Print out statistics
-                if generation > 0:
-                    best = max(population, key=Individual.fitness)
-                    print("Generation:", str(generation))
-                    print("Max fitness:", str(best.fitness()))
-                    print("Average generation time:", (now - start) / generation)
-                    print("Net time:", now - start)
-                    with open("levels/last.txt", 'w+') as f:
-                        for row in best.to_level():
-                            f.write("".join(row) + "\n")
-                generation += 1
-                # STUDENT Determine stopping condition
-                stop_condition = generation > 6
-                if stop_condition:
-                    break
-                # STUDENT Also consider using FI-2POP as in the Sorenson & Pasquier paper
-                gentime = time.time()
-                next_population = generate_successors(population)
-                gendone = time.time()
-                print("Generated successors in:", gendone - gentime, "seconds")
-                # Calculate fitness in batches in parallel
-                next_population = pool.map(Individual.calculate_fitness,
-                                           next_population,
-                                           batch_size)
-                popdone = time.time()
-                print("Calculated fitnesses in:", popdone - gendone, "seconds")
-                population = next_population
+            if ga_mode == "steady_state":
+                # two children per worker, so each has the next one waiting when it finishes
+                population = steady_state(pool, population, (generations - first_generation) * pop_limit,
+                                          2 * os.cpu_count(), report_from_first)
+            elif ga_mode == "islands":
+                population = evolve_islands(pool, population, generations - first_generation,
+                                            islands or os.cpu_count(), report_from_first)
+            else:
+                for generation in range(first_generation + 1, generations + 1):
+                    gentime = time.time()
+                    # FI-2POP: feasible parents breed with feasible ones and infeasible with infeasible,
+                    # each making as many children as there are of them
+                    if ga_mode == "fi2pop":
+                        groups = [[individual for individual in population if individual.feasible()],
+                                  [individual for individual in population if not individual.feasible()]]
+                        groups = [group for group in groups if group]
+                    else:
+                        groups = [population]
+                    if parallel_breeding:
+                        next_population = [child for group in groups for child in generate_successors(
+                            group, lambda pairs: breed_parallel(pool, pairs, batches))]
+                        print("Generated successors and calculated fitnesses in:", time.time() - gentime, "seconds")
+                    else:
+                        next_population = [child for group in groups for child in generate_successors(group)]
+                        gendone = time.time()
+                        print("Generated successors in:", gendone - gentime, "seconds")
+                        # Calculate fitness in batches in parallel
+                        next_population = evaluate(pool, next_population, batch_size, evaluator)
+                        popdone = time.time()
+                        print("Calculated fitnesses in:", popdone - gendone, "seconds")
+                    population = next_population
+                    report(population, generation)
         except KeyboardInterrupt:
             pass
+        finally:
+            if evaluator is not None:
+                evaluator.close()
+            if checkpointer is not None:
+                checkpointer.wait()
     return population
 
 
 if __name__ == "__main__":
-    final_gen = sorted(ga(), key=Individual.fitness, reverse=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", metavar="CHECKPOINT", help="carry on the run saved in CHECKPOINT")
+    args = parser.parse_args()
+    final_gen = sorted(ga(args.resume), key=merit, reverse=True)
     best = final_gen[0]
     print("Best fitness: " + str(best.fitness()))
     now = time.strftime("%m_%d_%H_%M_%S")
     # STUDENT You can change this if you want to blast out the whole generation, or ten random samples, or...
     for k in range(0, 10):
         with open("levels/" + now + "_" + str(k) + ".txt", 'w') as f:
-            for row in final_gen[k].to_level():
-                f.write("".join(row) + "\n")
+            for row in tiles.rows(final_gen[k].to_level()):
+                f.write(row + "\n")
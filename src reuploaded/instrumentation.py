@@ -0,0 +1,184 @@
+import collections
+import cProfile
+import csv
+import json
+import os
+import time
+import tracemalloc
+import numpy as np
+
+# Where the time in a ga() run goes.  Code being measured calls add(phase, seconds), count(name)
+# and sample(name, seconds), which do nothing unless enabled is set; each process keeps its own
+# totals.  Pool tasks go through call(), which sends the worker's totals back with the result for
+# merge() to fold in, and a Recorder writes one row per generation to a JSONL or CSV file.
+
+enabled = False
+
+# This process's totals since the last collect()
+phases = collections.defaultdict(float)
+counts = collections.defaultdict(int)
+samples = collections.defaultdict(list)
+
+# What workers have sent back since the Recorder last wrote a row: pid -> their totals
+workers = {}
+
+
+def add(phase, seconds):
+    if enabled:
+        phases[phase] += seconds
+
+
+def count(name, n=1):
+    if enabled:
+        counts[name] += n
+
+
+def sample(name, seconds):
+    if enabled:
+        samples[name].append(seconds)
+
+
+# This process's totals, which are then reset.
+def collect():
+    totals = {"phases": dict(phases), "counts": dict(counts), "samples": dict(samples)}
+    phases.clear()
+    counts.clear()
+    samples.clear()
+    return totals
+
+
+# Worker side of an instrumented pool task: (function(argument), what this process recorded doing it).
+def call(task):
+    function, argument = task
+    collect()
+    start = time.perf_counter()
+    result = function(argument)
+    totals = collect()
+    totals["pid"] = os.getpid()
+    totals["busy"] = time.perf_counter() - start
+    return result, totals
+
+
+# Fold in totals a worker sent back through call().
+def merge(totals):
+    into = workers.setdefault(totals["pid"], {"phases": collections.defaultdict(float),
+                                              "counts": collections.defaultdict(int),
+                                              "samples": collections.defaultdict(list),
+                                              "busy": 0.0})
+    for name, seconds in totals["phases"].items():
+        into["phases"][name] += seconds
+    for name, n in totals["counts"].items():
+        into["counts"][name] += n
+    for name, values in totals["samples"].items():
+        into["samples"][name].extend(values)
+    into["busy"] += totals["busy"]
+
+
+# pool.map(function, arguments, chunk_size) through call(), merging what the workers recorded.
+def pool_map(pool, function, arguments, chunk_size=1):
+    results = []
+    for result, totals in pool.map(call, [(function, argument) for argument in arguments], chunk_size):
+        merge(totals)
+        results.append(result)
+    return results
+
+
+def distribution(values):
+    values = np.array(values)
+    return {"n": len(values),
+            "mean": float(values.mean()),
+            "p50": float(np.percentile(values, 50)),
+            "p90": float(np.percentile(values, 90)),
+            "max": float(values.max())}
+
+
+# Writes a row to path (JSON lines, or CSV if it ends in .csv) each time record() is called, with
+# everything recorded in this process and the workers since the last one.  Every profile_every-th
+# generation is run under cProfile and every trace_every-th under tracemalloc (0 for never),
+# saved next to path.  cache_stats, if given, is the fitness cache's stats(), for the hit rate.
+# The first row is for generation first; after generation 1 (a resumed run) the rows already in
+# path from before that generation are kept and the rest dropped.
+class Recorder(object):
+    def __init__(self, path, profile_every=0, trace_every=0, cache_stats=None, first=1):
+        self.path = path
+        self.profile_every = profile_every
+        self.trace_every = trace_every
+        self.cache_stats = cache_stats
+        self.csv_fields = None
+        self.profiler = None
+        rows = self.read(first) if first > 1 and os.path.exists(path) else []
+        with open(path, "w"):
+            pass
+        for row in rows:
+            self.write(row)
+        self.begin(first)
+
+    # The rows in path for generations before first.
+    def read(self, first):
+        with open(self.path, newline="") as f:
+            if self.path.endswith(".csv"):
+                rows = list(csv.DictReader(f))
+                self.csv_fields = list(rows[0]) if rows else None
+            else:
+                rows = [json.loads(line) for line in f if line.strip()]
+        return [row for row in rows if int(row["generation"]) < first]
+
+    # Start the window for generation.
+    def begin(self, generation):
+        collect()
+        workers.clear()
+        self.started = time.perf_counter()
+        self.cache = self.cache_stats() if self.cache_stats is not None else None
+        if self.profile_every and generation % self.profile_every == 0:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if self.trace_every and generation % self.trace_every == 0:
+            tracemalloc.start()
+
+    # End the window for generation, write its row, and start the next.
+    def record(self, generation):
+        row = {"generation": generation, "seconds": time.perf_counter() - self.started}
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats("%s.gen%d.prof" % (self.path, generation))
+            self.profiler = None
+        if tracemalloc.is_tracing():
+            row["tracemalloc_peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024.0
+            with open("%s.gen%d.tracemalloc.txt" % (self.path, generation), "w") as f:
+                for stat in tracemalloc.take_snapshot().statistics("lineno")[:25]:
+                    f.write(str(stat) + "\n")
+            tracemalloc.stop()
+        main = collect()
+        for name, seconds in main["phases"].items():
+            row["phase." + name] = seconds
+        for name, n in main["counts"].items():
+            row["count." + name] = n
+        for pid, totals in sorted(workers.items()):
+            for name, seconds in totals["phases"].items():
+                row["phase." + name] = row.get("phase." + name, 0.0) + seconds
+            for name, n in totals["counts"].items():
+                row["count." + name] = row.get("count." + name, 0) + n
+            row["worker.%d.busy" % pid] = totals["busy"]
+            for name, values in totals["samples"].items():
+                for key, value in distribution(values).items():
+                    row["worker.%d.%s.%s" % (pid, name, key)] = value
+        if self.cache is not None:
+            cache = self.cache_stats()
+            hits = cache["hits"] - self.cache["hits"]
+            misses = cache["misses"] - self.cache["misses"]
+            row["cache.hits"] = hits
+            row["cache.hit_rate"] = hits / (hits + misses) if hits + misses else 0.0
+        self.write(row)
+        self.begin(generation + 1)
+
+    def write(self, row):
+        with open(self.path, "a", newline="") as f:
+            if not self.path.endswith(".csv"):
+                f.write(json.dumps(row, sort_keys=True) + "\n")
+                return
+            # the columns are fixed by the first row; later rows leave out anything new
+            if f.tell() == 0:
+                if self.csv_fields is None:
+                    self.csv_fields = sorted(row)
+                csv.DictWriter(f, self.csv_fields).writeheader()
+            csv.DictWriter(f, self.csv_fields, extrasaction="ignore").writerow(row)
@@ -1,138 +1,547 @@
+import instrumentation
 import pathfinding
 import numpy as np
+import search_kernel
 import sys
+import tiles
+import time
 
+# Limits on each path search: at most searchBudget states popped, and at most searchTimeLimit
+# seconds (None for no limit).  A search that hits one gives a partial result; see analyze().
+searchBudget = None
+searchTimeLimit = None
 
-def metrics(levelStr):
-    maxY = len(levelStr)
-    maxX = len(levelStr[0])
+# Which search analyze() runs: "auto" for search_kernel's when Numba is there to compile it (and no
+# searchTimeLimit is set, which the kernel can't keep to), "python" for pathfinding's, "kernel" for
+# search_kernel's regardless (uncompiled, it is slower: only for checking it).  Both give the same
+# measurements.
+searchKernel = "auto"
 
-    visited = set()
-    curX = 2
-    curY = 0
-    solids = set(['X', 'Q', 'S', '?', 'B', 'b', '[', ']', 'T', '|', '<', '>', 'v', 'f', 'm'])
+solids = set(['X', 'Q', 'S', '?', 'B', 'b', '[', ']', 'T', '|', '<', '>', 'v', 'f', 'm'])
+# solidity by character code, for looking up a whole level at once
+solidBytes = np.zeros(256, dtype=bool)
+solidBytes[[ord(c) for c in solids]] = True
 
-    def isSolid(tile):
-        return tile in solids
-    for yy in range(maxY - 2, -1, -1):
-        if (levelStr[yy][curX] == '-' or levelStr[yy][curX] == '*') and isSolid(levelStr[yy + 1][curX]):
-            curY = yy
-            break
+# Jump arcs as positions relative to the take-off point.
+jumps = [[(0, -1),
+          (0, -2),
+          (1, -3),
+          (1, -4),
+          (0, -4)],
+         [(0, -1),
+          (0, -2),
+          (0, -3),
+          (0, -4),
+          (1, -4)],
+         [(1, -1),
+          (1, -2),
+          (1, -3),
+          (1, -4),
+          (2, -4)],
+         [(1, -1),
+          (1, -2),
+          (2, -2),
+          (2, -3),
+          (3, -3),
+          (3, -4),
+          (4, -4),
+          (5, -3),
+          (6, -3),
+          (7, -3),
+          (8, -2),
+          (8, -1)],
+         [(1, -1),
+          (1, -2),
+          (2, -2),
+          (2, -3),
+          (3, -3),
+          (3, -4),
+          (4, -4),
+          (5, -4),
+          (6, -3),
+          (7, -3),
+          (8, -2),
+          (8, -1)]]
+# ...and as the move made on each step of the arc.
+jumpDiffs = []
+for jump in jumps:
+    jumpDiff = [jump[0]]
+    for ii in range(1, len(jump)):
+        jumpDiff.append((jump[ii][0] - jump[ii - 1][0], jump[ii][1] - jump[ii - 1][1]))
+    jumpDiffs.append(jumpDiff)
 
-    jumps = [[(0, -1),
-              (0, -2),
-              (1, -3),
-              (1, -4),
-              (0, -4)],
-             [(0, -1),
-              (0, -2),
-              (0, -3),
-              (0, -4),
-              (1, -4)],
-             [(1, -1),
-              (1, -2),
-              (1, -3),
-              (1, -4),
-              (2, -4)],
-             [(1, -1),
-              (1, -2),
-              (2, -2),
-              (2, -3),
-              (3, -3),
-              (3, -4),
-              (4, -4),
-              (5, -3),
-              (6, -3),
-              (7, -3),
-              (8, -2),
-              (8, -1)],
-             [(1, -1),
-              (1, -2),
-              (2, -2),
-              (2, -3),
-              (3, -3),
-              (3, -4),
-              (4, -4),
-              (5, -4),
-              (6, -3),
-              (7, -3),
-              (8, -2),
-              (8, -1)]]
-    jumpDiffs = []
-    for jump in jumps:
-        jumpDiff = [jump[0]]
-        for ii in range(1, len(jump)):
-            jumpDiff.append((jump[ii][0] - jump[ii - 1][0], jump[ii][1] - jump[ii - 1][1]))
-        jumpDiffs.append(jumpDiff)
-    jumps = jumpDiffs
-    visited = set()
+# A search state is (x, y) plus, mid-jump, which jump, how far into it and which direction.  It is
+# packed into one int, (x * maxY + y) * STATE_CELL + phase, where phase is 0 when walking or falling
+# and ((jump + 1) * JUMP_STEPS + step) * 2 + (direction == 1) in a jump.  This orders states the same
+# way as the tuples (x, y, -1) and (x, y, jump, step, direction) would, so ties in the search break
+# the same way.
+JUMP_STEPS = max(len(jump) for jump in jumpDiffs)
+STATE_CELL = (len(jumpDiffs) + 1) * JUMP_STEPS * 2
+
+
+def jumpPhase(jump, step, direction):
+    return ((jump + 1) * JUMP_STEPS + step) * 2 + (direction == 1)
+
+
+def encodeState(x, y, maxY, jump=-1, step=0, direction=-1):
+    phase = 0 if jump == -1 else jumpPhase(jump, step, direction)
+    return (x * maxY + y) * STATE_CELL + phase
+
+
+# The next step of a jump, by phase: (dx, dy, next phase), or None when walking, falling or landing.
+JUMP_NEXT = [None] * STATE_CELL
+for jump in range(len(jumpDiffs)):
+    for step in range(len(jumpDiffs[jump]) - 1):
+        for direction in (-1, 1):
+            dx, dy = jumpDiffs[jump][step + 1]
+            JUMP_NEXT[jumpPhase(jump, step, direction)] = (direction * dx, dy, jumpPhase(jump, step + 1, direction))
+# The first step of every jump, right then left: (dx, dy, phase after it)
+JUMP_STARTS = []
+for jump in range(len(jumpDiffs)):
+    dx, dy = jumpDiffs[jump][0]
+    JUMP_STARTS.append((dx, dy, jumpPhase(jump, 0, 1)))
+    JUMP_STARTS.append((-dx, dy, jumpPhase(jump, 0, -1)))
+# The jump arcs again, as (dx, dy) from the take-off point, once in each direction
+JUMP_ARCS = [[(direction * dx, dy) for dx, dy in jump] for jump in jumps for direction in (1, -1)]
+# JUMP_NEXT and JUMP_STARTS as arrays for search_kernel: (dx, dy, next phase) rows, next phase -1
+# where there's no next step
+JUMP_NEXT_ARRAY = np.array([step if step is not None else (0, 0, -1) for step in JUMP_NEXT], dtype=np.int64)
+JUMP_STARTS_ARRAY = np.array(JUMP_STARTS, dtype=np.int64)
+# The furthest any one move goes sideways, and the least any move costs, for search heuristics
+MAX_STEP_DX = max([1] + [abs(dx) for jumpDiff in jumpDiffs for dx, dy in jumpDiff])
+MIN_STEP_COST = 1
+
+
+def metrics(levelStr, parent=None, dirty=None):
+    return analyze(levelStr, parent, dirty).measurements
+
+
+# metrics() for many levels at once.  levels is a sequence of levels in any form levelGrid takes,
+# or an N x maxY x maxX array of compact levels.  The tile counts and surface linearity of the
+# whole batch are worked out in a handful of array operations, and the path searches share one
+# set of search tables.  Returns the measurements of each level, the same as metrics() gives.
+def metrics_batch(levels):
+    if isinstance(levels, np.ndarray) and levels.ndim == 3:
+        grids = tiles.to_ascii(levels)
+    else:
+        grids = [levelGrid(level) for level in levels]
+        if len(set(grid.shape for grid in grids)) > 1:
+            return [metrics(level) for level in levels]
+        if not grids:
+            return []
+        grids = np.stack(grids)
+    count = len(grids)
+    offsets = (np.arange(count, dtype=np.int64) * 256)[:, None]
+    histograms = np.bincount((grids.reshape(count, -1) + offsets).ravel(), minlength=256 * count).reshape(count, 256)
+    sums = surfaceSums(solidBytes[grids]).tolist()
+    buffers = pathfinding.SearchBuffers()
+    return [analyzeGrid(grid, histogram=histogram, linearity=linearityFromSums(*levelSums), buffers=buffers).measurements
+            for grid, histogram, levelSums in zip(grids, histograms, sums)]
+
+
+# Everything metrics() works out about one level.  Hand it back to analyze() as the parent of a
+# level that differs from it only slightly and the path search can be skipped when the changes
+# can't have affected it.
+class Analysis(object):
+    __slots__ = ["grid", "histogram", "start", "paths", "visitedCount", "searched", "measurements", "stats"]
+
+
+# When a search starting now has to stop, by searchTimeLimit.
+def searchDeadline():
+    return time.perf_counter() + searchTimeLimit if searchTimeLimit is not None else None
 
-    def getNeighbors(pos):
-        dist = pos[0]
-        pos = pos[1]
-        visited.add((pos[0], pos[1]))
-        below = (pos[0], pos[1] + 1)
+
+def useKernel():
+    if searchKernel == "auto":
+        return search_kernel.available and searchTimeLimit is None
+    return searchKernel == "kernel"
+
+
+# The search of analyze() through search_kernel: (goals, prev, mask of the cells expanded).
+def kernelSearch(solidGrid, src, goalLo, goalHi, subOptimal, stats):
+    maxY, maxX = solidGrid.shape
+    goals, prev, visited, popped, pushed, stale, peakHeap, exhausted = search_kernel.dense_search(
+        solidGrid.T.ravel(), maxY, maxX, src, goalLo, goalHi, float(subOptimal), JUMP_NEXT_ARRAY, JUMP_STARTS_ARRAY,
+        searchBudget if searchBudget is not None else -1)
+    stats.record(popped, pushed, stale, peakHeap, exhausted)
+    return goals, prev, visited.reshape(maxX, maxY).T
+
+
+# Count a finished search's pathfinding.SearchStats for instrumentation.
+def countSearch(stats):
+    instrumentation.count("statesPopped", stats.popped)
+    instrumentation.count("statesPushed", stats.pushed)
+    instrumentation.count("stalePops", stats.stale)
+    instrumentation.sample("peakHeap", stats.peakHeap)
+    if stats.exhausted:
+        instrumentation.count("searchesOverBudget")
+
+
+# The level as a maxY x maxX array of character codes.  Takes lists of strings, lists of lists of
+# characters and compact uint8 levels (see tiles.py).
+def levelGrid(levelStr):
+    if tiles.is_compact(levelStr):
+        return tiles.to_ascii(levelStr)
+    joined = "".join("".join(row) for row in levelStr)
+    return np.frombuffer(joined.encode("latin-1"), dtype=np.uint8).reshape(len(levelStr), -1)
+
+
+# How many of each tile a level has, indexed by character code, counted in one pass.
+def tileHistogram(levelStr):
+    return np.bincount(levelGrid(levelStr).ravel(), minlength=256)
+
+
+# The tile counts and percentages metrics() reports, from a tileHistogram.
+def tileStats(histogram):
+    def count(chars):
+        return int(sum(histogram[ord(c)] for c in chars))
+    totalSize = int(histogram.sum())
+    enemies = count('E')
+    empty = count('-Eo*')
+    pipes = count('|T')
+    breakable = count('B')
+    rewards = count('o?M')
+    powerups = count('M')
+    solid = count('X?|TMB')
+    return {'enemies': enemies,
+            'empty': empty,
+            'pipes': pipes,
+            'breakable': breakable,
+            'rewards': rewards,
+            'powerups': powerups,
+            'solid': solid,
+            'emptyPercentage': float(empty) / float(totalSize),
+            'decorationPercentage': (float(pipes) + float(breakable) + float(enemies) + float(rewards)) / float(totalSize),
+            'enemyPercentage': float(enemies) / float(totalSize),
+            'pipePercentage': float(pipes) / float(totalSize),
+            'breakablePercentage': float(breakable) / float(totalSize),
+            'rewardPercentage': float(rewards) / float(totalSize),
+            'powerupPercentage': float(powerups) / float(totalSize),
+            'solidPercentage': float(solid) / float(totalSize)}
+
+
+# The cells (x * maxY + y) in visited, as a maxY x maxX mask.
+def visitedGrid(visited, shape):
+    maxY, maxX = shape
+    seen = np.zeros(shape, dtype=bool)
+    if visited:
+        xs, ys = np.divmod(np.fromiter(visited, dtype=np.int64, count=len(visited)), maxY)
+        seen[ys, xs] = True
+    return seen
+
+
+# Every cell the search may have looked at, given the mask of cells it expanded: getNeighbors
+# only reads tiles from one column either side and from one row above to two rows below.
+def searchedCells(seen):
+    maxY, maxX = seen.shape
+    padded = np.zeros((maxY + 3, maxX + 2), dtype=bool)
+    padded[2:maxY + 2, 1:maxX + 1] = seen
+    searched = np.zeros(seen.shape, dtype=bool)
+    for dy in range(-1, 3):
+        for dx in range(-1, 2):
+            searched |= padded[2 - dy:2 - dy + maxY, 1 - dx:1 - dx + maxX]
+    return searched
+
+
+# The moves Mario can make from a search state, for pathfinding: a list of [dist, state] for the
+# states reachable from node = (dist, state).  Every expanded cell is added to visited.
+def neighborFunction(solidGrid, visited):
+    maxY, maxX = solidGrid.shape
+    # solidity by cell number, x * maxY + y, to match the state layout
+    solidCells = solidGrid.T.ravel().tolist()
+
+    def getNeighbors(node):
+        dist = node[0]
+        state = node[1]
+        cell, phase = divmod(state, STATE_CELL)
+        x, y = divmod(cell, maxY)
+        visited.add(cell)
         neighbors = []
-        if below[1] >= maxY:
+        if y + 1 >= maxY:
             return []
-        if pos[2] != -1:
-            ii = pos[3] + 1
-            jump = pos[2]
-            if ii < len(jumps[jump]):
-                if not (pos[0] + pos[4] * jumps[jump][ii][0] >= maxX or pos[0] + pos[4] * jumps[jump][ii][0] < 0 or pos[1] + jumps[jump][ii][1] < 0) and not isSolid(levelStr[pos[1] + jumps[jump][ii][1]][pos[0] + pos[4] * jumps[jump][ii][0]]):
-                    neighbors.append([dist + 1, (pos[0] + pos[4] * jumps[jump][ii][0], pos[1] + jumps[jump][ii][1], jump, ii, pos[4])])
-
-        if isSolid(levelStr[below[1]][below[0]]):
-            if pos[0] + 1 < maxX and not isSolid(levelStr[pos[1]][pos[0] + 1]):
-                neighbors.append([dist + 1, (pos[0] + 1, pos[1], -1)])
-            if pos[0] - 1 >= 0 and not isSolid(levelStr[pos[1]][pos[0] - 1]):
-                neighbors.append([dist + 1, (pos[0] - 1, pos[1], -1)])
-
-            for jump in range(len(jumps)):
-                ii = 0
-                if not (pos[0] + jumps[jump][ii][0] >= maxX or pos[1] + jumps[jump][ii][1] < 0) and not isSolid(levelStr[pos[1] + jumps[jump][ii][1]][pos[0] + jumps[jump][ii][0]]):
-                    neighbors.append([dist + ii + 1, (pos[0] + jumps[jump][ii][0], pos[1] + jumps[jump][ii][1], jump, ii, 1)])
-
-                if not (pos[0] - jumps[jump][ii][0] < 0 or pos[1] + jumps[jump][ii][1] < 0) and not isSolid(levelStr[pos[1] + jumps[jump][ii][1]][pos[0] - jumps[jump][ii][0]]):
-                    neighbors.append([dist + ii + 1, (pos[0] - jumps[jump][ii][0], pos[1] + jumps[jump][ii][1], jump, ii, -1)])
+        step = JUMP_NEXT[phase]
+        if step is not None:
+            dx, dy, nextPhase = step
+            if 0 <= x + dx < maxX and y + dy >= 0 and not solidCells[cell + dx * maxY + dy]:
+                neighbors.append([dist + 1, (cell + dx * maxY + dy) * STATE_CELL + nextPhase])
+
+        if solidCells[cell + 1]:
+            if x + 1 < maxX and not solidCells[cell + maxY]:
+                neighbors.append([dist + 1, (cell + maxY) * STATE_CELL])
+            if x - 1 >= 0 and not solidCells[cell - maxY]:
+                neighbors.append([dist + 1, (cell - maxY) * STATE_CELL])
+
+            for dx, dy, nextPhase in JUMP_STARTS:
+                if 0 <= x + dx < maxX and y + dy >= 0 and not solidCells[cell + dx * maxY + dy]:
+                    neighbors.append([dist + 1, (cell + dx * maxY + dy) * STATE_CELL + nextPhase])
 
         else:
-            neighbors.append([dist + 1, (pos[0], pos[1] + 1, -1)])
-            if pos[1] + 1 < maxY:
-                if pos[0] + 1 < maxX and not isSolid(levelStr[pos[1] + 1][pos[0] + 1]):
-                    neighbors.append([dist + 1.4, (pos[0] + 1, pos[1] + 1, -1)])
-                if pos[0] - 1 >= 0 and not isSolid(levelStr[pos[1] + 1][pos[0] - 1]):
-                    neighbors.append([dist + 1.4, (pos[0] - 1, pos[1] + 1, -1)])
-            if pos[1] + 2 < maxY:
-                if pos[0] + 1 < maxX and not isSolid(levelStr[pos[1] + 2][pos[0] + 1]):
-                    neighbors.append([dist + 2, (pos[0] + 1, pos[1] + 2, -1)])
-                if pos[0] - 1 >= 0 and not isSolid(levelStr[pos[1] + 2][pos[0] - 1]):
-                    neighbors.append([dist + 2, (pos[0] - 1, pos[1] + 2, -1)])
+            neighbors.append([dist + 1, (cell + 1) * STATE_CELL])
+            if x + 1 < maxX and not solidCells[cell + maxY + 1]:
+                neighbors.append([dist + 1.4, (cell + maxY + 1) * STATE_CELL])
+            if x - 1 >= 0 and not solidCells[cell - maxY + 1]:
+                neighbors.append([dist + 1.4, (cell - maxY + 1) * STATE_CELL])
+            if y + 2 < maxY:
+                if x + 1 < maxX and not solidCells[cell + maxY + 2]:
+                    neighbors.append([dist + 2, (cell + maxY + 2) * STATE_CELL])
+                if x - 1 >= 0 and not solidCells[cell - maxY + 2]:
+                    neighbors.append([dist + 2, (cell - maxY + 2) * STATE_CELL])
         return neighbors
-    subOptimal = 0
+    return getNeighbors
 
-    paths = pathfinding.dijkstras_shortest_path((curX, curY, -1), lambda pos: pos[0] == maxX - 2, getNeighbors, subOptimal)
 
-    pathDict = {path[0]: [] for path in paths}
+# Every cell Mario can get to from start, worked out a column at a time: a column's cells are the
+# bits of an int (bit y for row y), so all sixteen rows move together.  The moves are the ones
+# getNeighbors makes, jump arcs cut short by solid tiles included, so this is exactly the set of
+# cells the full search visits when it can't reach the end, and a bound on it when it can.
+# Returns one int per column.
+def reachableColumns(solidGrid, start):
+    maxY, maxX = solidGrid.shape
+    full = (1 << maxY) - 1
+    bottom = 1 << (maxY - 1)
+    solid = (solidGrid.astype(np.int64) << np.arange(maxY)[:, None]).sum(axis=0).tolist()
+    free = [full & ~column for column in solid]
+    reached = [0] * maxX
+    pending = [0] * maxX
+    reached[start[0]] = pending[start[0]] = 1 << start[1]
+    work = [start[0]]
 
-    for yy in range(maxY):
-        s = ''
-        for xx in range(maxX):
-            if (xx, yy) in visited:
-                s += '*'
+    def reach(x, bits):
+        new = bits & ~reached[x]
+        if new:
+            reached[x] |= new
+            if not pending[x]:
+                work.append(x)
+            pending[x] |= new
+
+    while work:
+        x = work.pop()
+        # nothing moves on from the bottom row
+        bits = pending[x] & ~bottom
+        pending[x] = 0
+        ground = solid[x] >> 1
+        stand = bits & ground
+        air = bits & ~ground
+        if air:
+            reach(x, air << 1)
+            for nx in (x + 1, x - 1):
+                if 0 <= nx < maxX:
+                    reach(nx, ((air << 1) | (air << 2)) & free[nx])
+        if stand:
+            for nx in (x + 1, x - 1):
+                if 0 <= nx < maxX:
+                    reach(nx, stand & free[nx])
+            for arc in JUMP_ARCS:
+                # take-off rows still in the air; arcs only ever go up from the take-off row
+                alive = stand
+                for dx, dy in arc:
+                    nx = x + dx
+                    if not 0 <= nx < maxX:
+                        break
+                    alive &= free[nx] << -dy
+                    if not alive:
+                        break
+                    reach(nx, alive >> -dy)
+    return reached
+
+
+# The reachableColumns as a maxY x maxX mask.
+def reachableGrid(reached, maxY):
+    return (np.array(reached, dtype=np.int64)[None, :] >> np.arange(maxY)[:, None]) & 1 == 1
+
+
+# A quick check of a level before measuring it: (whether the end can be reached, how many cells can
+# be reached).  When the end can't be reached the cell count is exact; otherwise it is an upper
+# bound on the cells the full search visits.
+def reachability(levelStr):
+    grid = levelGrid(levelStr)
+    solidGrid = solidBytes[grid]
+    reached = reachableColumns(solidGrid, startPosition(grid, solidGrid))
+    return reached[grid.shape[1] - 2] != 0, sum(bin(column).count("1") for column in reached)
+
+
+# The cheap checks FI-2POP (see ga.py) sorts levels by, with no path search: how far a level is
+# from feasible, 0 if it is.  One for every pipe piece with nothing solid under it, for every start
+# tile too many or too few and for a missing flag or flagpole, plus, if the end can't be reached, 1
+# and the fraction of the level beyond the furthest column that can.
+def constraintDistance(levelStr):
+    grid = levelGrid(levelStr)
+    solidGrid = solidBytes[grid]
+    pipes = (grid == ord('|')) | (grid == ord('T'))
+    distance = int((pipes[:-1] & ~solidGrid[1:]).sum())
+    counts = np.bincount(grid.ravel(), minlength=256)
+    distance += abs(int(counts[ord('m')]) - 1) + int(counts[ord('f')] == 0) + int(counts[ord('v')] == 0)
+    reached = reachableColumns(solidGrid, startPosition(grid, solidGrid))
+    end = grid.shape[1] - 2
+    if not reached[end]:
+        furthest = max(x for x, column in enumerate(reached) if column)
+        distance += 1 + (end - furthest) / end
+    return distance
+
+
+# Where Mario starts: on the first floor, from the bottom, in column 2.
+def startPosition(grid, solidGrid):
+    maxY = grid.shape[0]
+    curX = 2
+    curY = 0
+    for yy in range(maxY - 2, -1, -1):
+        if (grid[yy][curX] == ord('-') or grid[yy][curX] == ord('*')) and solidGrid[yy + 1][curX]:
+            curY = yy
+            break
+    return curX, curY
+
+
+# How far a state is from the end of the level, at best: the columns left to cross over the most
+# any move goes sideways, times the least a move costs.  Never overestimates, so it suits A*.
+def remainingDistance(maxX, maxY):
+    stateColumn = maxY * STATE_CELL
+
+    def heuristic(state):
+        return abs(maxX - 2 - state // stateColumn) / MAX_STEP_DX * MIN_STEP_COST
+    return heuristic
+
+
+# Whether Mario can get from the start to the end of the level at all.  Only reachability matters,
+# so this is a best-first search towards the end that stops the moment it finds a way there, far
+# less work than the full search in metrics() on solvable levels.  On unsolvable ones both have to
+# exhaust the reachable states.  None if the search ran out of budget before it could tell.
+def solvable(levelStr):
+    grid = levelGrid(levelStr)
+    maxY, maxX = grid.shape
+    solidGrid = solidBytes[grid]
+    curX, curY = startPosition(grid, solidGrid)
+    stateColumn = maxY * STATE_CELL
+    goal = (maxX - 2) * stateColumn
+    stats = pathfinding.SearchStats()
+    result = pathfinding.best_first_reachable(encodeState(curX, curY, maxY),
+                                              lambda state: goal <= state < goal + stateColumn,
+                                              neighborFunction(solidGrid, set()),
+                                              remainingDistance(maxX, maxY), maxX * stateColumn,
+                                              stats, searchBudget, searchDeadline())
+    countSearch(stats)
+    return result
+
+
+# The length of the shortest way through the level, or None if there isn't one (or the search ran
+# out of budget): an A* search that stops at the first goal it reaches.
+def shortestPathLength(levelStr):
+    grid = levelGrid(levelStr)
+    maxY, maxX = grid.shape
+    solidGrid = solidBytes[grid]
+    curX, curY = startPosition(grid, solidGrid)
+    stateColumn = maxY * STATE_CELL
+    goal = (maxX - 2) * stateColumn
+    stats = pathfinding.SearchStats()
+    length, prev = pathfinding.a_star_shortest_path(encodeState(curX, curY, maxY),
+                                                    lambda state: goal <= state < goal + stateColumn,
+                                                    neighborFunction(solidGrid, set()),
+                                                    remainingDistance(maxX, maxY), maxX * stateColumn,
+                                                    stats, searchBudget, searchDeadline())
+    countSearch(stats)
+    return length
+
+
+# How straight the level's surface is: |Pearson r| between the x and y of every solid tile with
+# no solid tile above it.  Levels where either coordinate doesn't vary (a flat floor, say) get 0.
+def surfaceLinearity(solidGrid):
+    return linearityFromSums(*surfaceSums(solidGrid[None])[0].tolist())
+
+
+# For each of a stack of solidity grids (N x maxY x maxX), the sums surfaceLinearity needs over its
+# surface tiles: count, sum of x, sum of y, sum of x^2, sum of y^2 and sum of xy, as an N x 6 array.
+def surfaceSums(solidGrids):
+    surface = (solidGrids[:, 1:] & ~solidGrids[:, :-1]).astype(np.int64)
+    xs = np.arange(surface.shape[2], dtype=np.int64)
+    ys = np.arange(surface.shape[1], dtype=np.int64)
+    rows = surface.sum(axis=2)
+    columns = surface.sum(axis=1)
+    return np.stack([rows.sum(axis=1), columns @ xs, rows @ ys, columns @ (xs * xs), rows @ (ys * ys),
+                     (surface @ xs) @ ys], axis=1)
+
+
+def linearityFromSums(n, sumX, sumY, sumXX, sumYY, sumXY):
+    # n^2 times the variances and covariance, exact in integers
+    sxx = n * sumXX - sumX ** 2
+    syy = n * sumYY - sumY ** 2
+    sxy = n * sumXY - sumX * sumY
+    if sxx == 0 or syy == 0:
+        return 0.0
+    return min(1.0, abs(sxy) / (sxx * syy) ** 0.5)
+
+
+# Measure levelStr.  If parent is the Analysis of a similar level, only the columns that differ
+# are recounted, and the parent's path search is reused when no tile it looked at changed
+# solidity.  dirty = (lo, hi) promises that only columns lo through hi - 1 differ from the parent.
+def analyze(levelStr, parent=None, dirty=None):
+    return analyzeGrid(levelGrid(levelStr), parent, dirty)
+
+
+# analyze() on a levelGrid.  metrics_batch passes in the histogram and linearity it has already
+# worked out, and the SearchBuffers its searches share.
+def analyzeGrid(grid, parent=None, dirty=None, histogram=None, linearity=None, buffers=None):
+    maxY, maxX = grid.shape
+    if parent is not None and parent.grid.shape != grid.shape:
+        parent = None
+    lo, hi = dirty if dirty is not None else (0, maxX)
+
+    solidGrid = solidBytes[grid]
+    curX, curY = startPosition(grid, solidGrid)
+
+    visited = set()
+    stateColumn = maxY * STATE_CELL
+    getNeighbors = neighborFunction(solidGrid, visited)
+    subOptimal = 0
+
+    stats = pathfinding.SearchStats()
+    reuse = False
+    if parent is not None and parent.start == (curX, curY) and not parent.stats.exhausted:
+        changed = solidGrid[:, lo:hi] != solidBytes[parent.grid[:, lo:hi]]
+        reuse = not (changed & parent.searched[:, lo:hi]).any()
+    instrumentation.count("analyses")
+    if reuse:
+        instrumentation.count("searchesReused")
+        paths = parent.paths
+        visitedCount = parent.visitedCount
+        searched = parent.searched
+        stats = parent.stats
+    else:
+        # Levels the end can't be reached in don't need the search at all: the bitwise pass finds
+        # exactly the cells it would visit.
+        reached = reachableColumns(solidGrid, (curX, curY))
+        if not reached[maxX - 2]:
+            paths = []
+            seen = reachableGrid(reached, maxY)
+            visitedCount = int(seen.sum())
+            instrumentation.count("searchesSkipped")
+            searched = searchedCells(seen)
+        else:
+            goal = (maxX - 2) * stateColumn
+            src = encodeState(curX, curY, maxY)
+            if useKernel():
+                goals, prev, seen = kernelSearch(solidGrid, src, goal, goal + stateColumn, subOptimal, stats)
+                visitedCount = int(seen.sum())
             else:
-                s += levelStr[yy][xx]
+                goals, prev = pathfinding.dijkstras_shortest_path_dense(src,
+                                                                        lambda state: goal <= state < goal + stateColumn,
+                                                                        getNeighbors, subOptimal, maxX * stateColumn,
+                                                                        stats, searchBudget, searchDeadline(), buffers)
+                seen = visitedGrid(visited, grid.shape)
+                visitedCount = len(visited)
+            paths = [(length, pathfinding.path_to(prev, state)) for length, state in goals]
+            instrumentation.count("searches")
+            instrumentation.count("cellsVisited", visitedCount)
+            countSearch(stats)
+            searched = searchedCells(seen)
+
+    searchPaths = paths
+    pathDict = {path[0]: [] for path in paths}
 
-        # print s
     for path in paths:
-        pathDict[path[0]].append([(p[0], p[1]) for p in path[1]])
+        pathDict[path[0]].append([divmod(p // STATE_CELL, maxY) for p in path[1]])
     # print paths
     paths = pathDict
     pathStats = {}
-    gaps = set()
-    for xx in range(maxX):
-        if levelStr[maxY - 1][xx] == '-':
-            gaps.add(xx)
+    gaps = set(np.flatnonzero(grid[maxY - 1] == ord('-')).tolist())
     for pathLength in paths:
         pathStats[pathLength] = {'jumps': [], 'meaningfulJumps': []}
         for path in paths[pathLength]:
@@ -140,7 +549,7 @@ def metrics(levelStr):
             meaningfulJumps = 0
             onGround = True
             for p in path:
-                if p[1] < 15 and isSolid(levelStr[p[1] + 1][p[0]]):
+                if p[1] < 15 and solidGrid[p[1] + 1][p[0]]:
                     onGround = True
                 elif onGround:
                     jumps += 1
@@ -176,50 +585,30 @@ def metrics(levelStr):
             temp = p - float(totalMeaningfulJumps) / float(pathcount)
             meaningfulJumpVariance += temp * temp
 
-    totalSize = maxX * maxY
     #negativeSpace = float(len(visited))/float(totalSize)
-    enemies = 0
-    pipes = 0
-    empty = 0
-    breakable = 0
-    rewards = 0
-    solid = 0
-    powerups = 0
-    for row in levelStr:
-        enemies += row.count('E')
-        empty += row.count('-') + row.count('E') + row.count('o') + row.count('*')
-        pipes += row.count('|') + row.count('T')
-        breakable += row.count('B')
-        rewards += row.count('o') + row.count('?') + row.count('M')
-        powerups += row.count('M')
-        solid += row.count('X') + row.count('?') + row.count('|') + row.count('T') + row.count('M') + row.count('B')
-
-    negativeSpace = float(len(visited)) / float(empty)
+    if histogram is not None:
+        pass
+    elif parent is None:
+        histogram = np.bincount(grid.ravel(), minlength=256)
+    else:
+        # recount only the columns that differ from the parent
+        cols = lo + np.flatnonzero((grid[:, lo:hi] != parent.grid[:, lo:hi]).any(axis=0))
+        histogram = (parent.histogram
+                     - np.bincount(parent.grid[:, cols].ravel(), minlength=256)
+                     + np.bincount(grid[:, cols].ravel(), minlength=256))
+    tileCounts = tileStats(histogram)
+    empty = tileCounts['empty']
+
+    negativeSpace = float(visitedCount) / float(empty)
     pathPercentage = float(smallest) / float(empty)
-    emptyPercentage = float(empty) / float(totalSize)
-    decorationPercentage = (float(pipes) + float(breakable) + float(enemies) + float(rewards)) / float(totalSize)
-    leniency = enemies - powerups * 0.5 - 0.5 * rewards + len(gaps)
-
-    solidX = []
-    solidY = []
-    yy = 0
-    for yy in range(maxY):
-        xx = 0
-        if yy > 0:
-            for c in levelStr[yy]:
-                if isSolid(c) and not isSolid(levelStr[yy - 1][xx]):
-                    # solidPts.append([xx,yy])
-                    solidX.append(xx)
-                    solidY.append(yy)
-                xx += 1
-        yy += 1
-    x = np.array(solidX)
-    y = np.array(solidY)
-    from scipy import stats
-    slope, intercept, r_value, p_value, std_err = stats.linregress(x, y)
-    linearity = np.abs(r_value)
+    emptyPercentage = tileCounts['emptyPercentage']
+    decorationPercentage = tileCounts['decorationPercentage']
+    leniency = tileCounts['enemies'] - tileCounts['powerups'] * 0.5 - 0.5 * tileCounts['rewards'] + len(gaps)
+
+    if linearity is None:
+        linearity = surfaceLinearity(solidGrid)
     if len(paths) > 0:
-        return {'length': maxX,
+        measurements = {'length': maxX,
                 'negativeSpace': negativeSpace,
                 'pathPercentage': pathPercentage,
                 'emptyPercentage': emptyPercentage,
@@ -232,7 +621,7 @@ def metrics(levelStr):
                 'linearity': linearity,
                 'solvability': 1.0}
     else:
-        return {
+        measurements = {
             'length': maxX,
             'negativeSpace': negativeSpace,
             'pathPercentage': -1,
@@ -245,6 +634,28 @@ def metrics(levelStr):
             'jumpVariance': -1,
             'linearity': linearity,
             'solvability': 0}
+        # Out of budget before any path turned up: the level can be finished (the reachability
+        # pass says so) but how is unknown, so the path measurements stay at -1
+        if stats.exhausted:
+            measurements['solvability'] = 1.0
+    # 0 if the search ran out of budget, and the path measurements come from the paths it had
+    # found by then (if any)
+    measurements['searchComplete'] = 0.0 if stats.exhausted else 1.0
+    # the rest of the tile statistics, for fitness functions that want them
+    for key in ('enemyPercentage', 'pipePercentage', 'breakablePercentage', 'rewardPercentage',
+                'powerupPercentage', 'solidPercentage'):
+        measurements[key] = tileCounts[key]
+
+    analysis = Analysis()
+    analysis.grid = grid
+    analysis.histogram = histogram
+    analysis.start = (curX, curY)
+    analysis.paths = searchPaths
+    analysis.visitedCount = visitedCount
+    analysis.searched = searched
+    analysis.measurements = measurements
+    analysis.stats = stats
+    return analysis
 
 
 if __name__ == "__main__":
@@ -252,4 +663,5 @@ if __name__ == "__main__":
     with open(name, 'r') as openFile:
         lines = openFile.readlines()
     print(len(lines), len(lines[0]))
+    print(tileStats(tileHistogram(lines)))
     print(metrics(lines))
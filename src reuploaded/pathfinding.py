@@ -1,25 +1,70 @@
-
 from math import sqrt
 from heapq import heappush, heappop
+from time import perf_counter
+
+# Every search here takes an optional SearchStats to fill in, and an optional budget: at most
+# budget states popped, and/or no popping after deadline (a time.perf_counter() time).  A search
+# that runs out of budget stops where it is, sets stats.exhausted and returns what it has so far
+# (see each search for what that means).  The clock is only read every DEADLINE_CHECK pops.
+DEADLINE_CHECK = 256
+
+
+# What a search did: states popped off the heap (including stale entries), states pushed, pops of
+# entries that had gone stale, the most entries the heap held at once, and whether the budget ran
+# out before the search finished.
+class SearchStats(object):
+    __slots__ = ["popped", "pushed", "stale", "peakHeap", "exhausted"]
+
+    def __init__(self):
+        self.popped = 0
+        self.pushed = 0
+        self.stale = 0
+        self.peakHeap = 0
+        self.exhausted = False
+
+    def record(self, popped, pushed, stale, peakHeap, exhausted):
+        self.popped += popped
+        self.pushed += pushed
+        self.stale += stale
+        self.peakHeap = max(self.peakHeap, peakHeap)
+        self.exhausted = self.exhausted or exhausted
 
-def dijkstras_shortest_path(src, isdst, adj,subOptimal):
+
+# Whether a search that has popped popped states is out of budget.
+def overBudget(popped, budget, deadline):
+    if budget is not None and popped >= budget:
+        return True
+    return deadline is not None and popped % DEADLINE_CHECK == 0 and perf_counter() > deadline
+
+
+# Out of budget, this returns the paths found so far: each one is still right, but there may have
+# been more (or any at all) to find.
+def dijkstras_shortest_path(src, isdst, adj, subOptimal, stats=None, budget=None, deadline=None):
     dist = {}
     prev = {}
     dist[src] = 0
     prev[src] = None
     heap = [(dist[src], src)]
+    popped = pushed = stale = 0
+    limited = budget is not None or deadline is not None
+    peakHeap = 1
+    exhausted = False
 
     pathLength = float('inf')
     paths = []
     while heap:
+        if limited and overBudget(popped, budget, deadline):
+            exhausted = True
+            break
         node = heappop(heap)
+        popped += 1
 
         if isdst(node[1]):
             if node[0] < pathLength:
                 pathLength = node[0]
                 path = []
                 nodeR = node[1]
-                while nodeR:
+                while nodeR is not None:
                     path.append(nodeR)
                     nodeR = prev[nodeR]
                 path.reverse()
@@ -30,17 +75,203 @@ def dijkstras_shortest_path(src, isdst, adj,subOptimal):
             else:
                 path = []
                 nodeR = node[1]
-                while nodeR:
+                while nodeR is not None:
                     path.append(nodeR)
                     nodeR = prev[nodeR]
                 path.reverse()
                 paths.append((node[0],path))
                 continue
+        if node[0] > dist[node[1]]:
+            stale += 1
 
         for next_node in adj(node):
             if next_node[1] not in dist or next_node[0] < dist[next_node[1]]:
                 dist[next_node[1]] = next_node[0]
                 prev[next_node[1]] = node[1]
                 heappush(heap, next_node)
+                pushed += 1
+                if len(heap) > peakHeap:
+                    peakHeap = len(heap)
 
+    if stats is not None:
+        stats.record(popped, pushed, stale, peakHeap, exhausted)
     return paths
+
+
+# dist and prev tables for dijkstras_shortest_path_dense to reuse from one search to the next,
+# rather than allocating them every time.  Only the entries the last search wrote are reset.
+class SearchBuffers(object):
+    __slots__ = ["dist", "prev", "touched"]
+
+    def __init__(self):
+        self.dist = []
+        self.prev = []
+        self.touched = []
+
+    # Clean (dist, prev, touched) lists for a search over stateCount states.
+    def take(self, stateCount):
+        if len(self.dist) != stateCount:
+            self.dist = [float('inf')] * stateCount
+            self.prev = [-1] * stateCount
+        else:
+            dist = self.dist
+            prev = self.prev
+            for state in self.touched:
+                dist[state] = float('inf')
+                prev[state] = -1
+        self.touched = []
+        return self.dist, self.prev, self.touched
+
+
+# dijkstras_shortest_path for dense, bounded state spaces, where every state is an int in
+# range(stateCount): dist and prev are flat preallocated lists rather than dicts keyed on states,
+# and heap entries that went stale are skipped when popped instead of being expanded again.
+# Finds the same goals as dijkstras_shortest_path, but returns them as (length, goal) pairs
+# along with the prev table; path_to rebuilds a path only when it's wanted.  Out of budget, the
+# goals are the ones found so far, as for dijkstras_shortest_path.  With buffers (SearchBuffers),
+# the tables come from there, and the prev table returned is only good until its next search.
+def dijkstras_shortest_path_dense(src, isdst, adj, subOptimal, stateCount, stats=None, budget=None, deadline=None,
+                                  buffers=None):
+    if buffers is None:
+        dist = [float('inf')] * stateCount
+        prev = [-1] * stateCount
+        touched = None
+    else:
+        dist, prev, touched = buffers.take(stateCount)
+        touched.append(src)
+    dist[src] = 0
+    heap = [(dist[src], src)]
+    popped = pushed = stale = 0
+    limited = budget is not None or deadline is not None
+    peakHeap = 1
+    exhausted = False
+
+    pathLength = float('inf')
+    goals = []
+    while heap:
+        if limited and overBudget(popped, budget, deadline):
+            exhausted = True
+            break
+        node = heappop(heap)
+        popped += 1
+
+        if isdst(node[1]):
+            if node[0] > pathLength + subOptimal:
+                break
+            if node[0] < pathLength:
+                pathLength = node[0]
+            goals.append((node[0], node[1]))
+            continue
+        if node[0] > dist[node[1]]:
+            stale += 1
+            continue
+
+        for next_node in adj(node):
+            if next_node[0] < dist[next_node[1]]:
+                dist[next_node[1]] = next_node[0]
+                prev[next_node[1]] = node[1]
+                heappush(heap, next_node)
+                pushed += 1
+                if len(heap) > peakHeap:
+                    peakHeap = len(heap)
+                if touched is not None:
+                    touched.append(next_node[1])
+
+    if stats is not None:
+        stats.record(popped, pushed, stale, peakHeap, exhausted)
+    return goals, prev
+
+
+# The path from the source to state, given the prev table from dijkstras_shortest_path_dense.
+def path_to(prev, state):
+    path = []
+    while state != -1:
+        path.append(state)
+        state = prev[state]
+    path.reverse()
+    return path
+
+
+# A* over the same kind of dense state space: states are popped in order of distance plus
+# heuristic(state), which must never overestimate the distance left to a goal (and for the stale
+# entry check, never drop by more than a move costs).  Stops at the first goal popped and returns
+# its (length, prev table) for path_to, or (None, prev) when no goal is reachable or the budget
+# ran out (stats.exhausted tells which).
+def a_star_shortest_path(src, isdst, adj, heuristic, stateCount, stats=None, budget=None, deadline=None):
+    dist = [float('inf')] * stateCount
+    prev = [-1] * stateCount
+    dist[src] = 0
+    # ties on the estimate go to the state furthest along, which is much quicker on plateaus
+    heap = [(heuristic(src), 0, src)]
+    popped = pushed = stale = 0
+    limited = budget is not None or deadline is not None
+    peakHeap = 1
+    exhausted = False
+    found = None
+
+    while heap:
+        if limited and overBudget(popped, budget, deadline):
+            exhausted = True
+            break
+        estimate, negd, state = heappop(heap)
+        popped += 1
+        d = -negd
+        if isdst(state):
+            found = d
+            break
+        if d > dist[state]:
+            stale += 1
+            continue
+
+        for next_node in adj((d, state)):
+            if next_node[0] < dist[next_node[1]]:
+                dist[next_node[1]] = next_node[0]
+                prev[next_node[1]] = state
+                heappush(heap, (next_node[0] + heuristic(next_node[1]), -next_node[0], next_node[1]))
+                pushed += 1
+                if len(heap) > peakHeap:
+                    peakHeap = len(heap)
+
+    if stats is not None:
+        stats.record(popped, pushed, stale, peakHeap, exhausted)
+    return found, prev
+
+
+# Whether any goal can be reached from src at all, without caring how far it is: a best-first
+# search that expands the state with the lowest heuristic(state) first and stops as soon as it
+# generates a goal.  Each state is expanded at most once.  When no goal is reachable this still
+# has to exhaust every reachable state, like the other searches.  None if the budget ran out
+# before it could tell.
+def best_first_reachable(src, isdst, adj, heuristic, stateCount, stats=None, budget=None, deadline=None):
+    if isdst(src):
+        return True
+    seen = bytearray(stateCount)
+    seen[src] = 1
+    heap = [(heuristic(src), src)]
+    popped = pushed = 0
+    limited = budget is not None or deadline is not None
+    peakHeap = 1
+    result = False
+
+    while heap:
+        if limited and overBudget(popped, budget, deadline):
+            result = None
+            break
+        node = heappop(heap)
+        popped += 1
+        for next_node in adj((0, node[1])):
+            if not seen[next_node[1]]:
+                if isdst(next_node[1]):
+                    result = True
+                    break
+                seen[next_node[1]] = 1
+                heappush(heap, (heuristic(next_node[1]), next_node[1]))
+                pushed += 1
+                if len(heap) > peakHeap:
+                    peakHeap = len(heap)
+        if result:
+            break
+
+    if stats is not None:
+        stats.record(popped, pushed, 0, peakHeap, result is None)
+    return result
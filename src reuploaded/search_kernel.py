@@ -0,0 +1,149 @@
+import heapq
+import sys
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# The level search of metrics.analyze (pathfinding.dijkstras_shortest_path_dense over
+# metrics.getNeighbors' moves) as one function over arrays, which Numba compiles to native code
+# when it is installed.  Without Numba, available is False and metrics keeps to the Python search;
+# the kernel still runs as plain Python, about half as fast, which is enough to check it against the
+# Python search:
+#
+#     python search_kernel.py
+#
+# measures every level of the benchmark corpus (the committed levels and more) both ways and
+# reports any measurement that differs.
+
+available = numba is not None
+
+
+def jit(function):
+    return numba.njit(cache=True)(function) if available else function
+
+
+# Relax the edge from fromState to state, of total length d.  Returns how many states it pushed.
+@jit
+def relax(heap, dist, prev, d, state, fromState):
+    if d < dist[state]:
+        dist[state] = d
+        prev[state] = fromState
+        heapq.heappush(heap, (d, state))
+        return 1
+    return 0
+
+
+# Search from src to any state in [goalLo, goalHi), the same way, in the same order, as the Python
+# search.  solidCells is solidity by cell number, x * maxY + y; jumpNext has a row (dx, dy, next
+# phase) for every phase, next phase -1 where metrics.JUMP_NEXT is None; jumpStarts has a row for
+# each of metrics.JUMP_STARTS.  budget is the most states to pop, -1 for no limit.
+#
+# Returns (goals, prev, visited, popped, pushed, stale, peakHeap, exhausted): goals and prev as
+# from dijkstras_shortest_path_dense, and visited the cells expanded, by cell number.
+@jit
+def dense_search(solidCells, maxY, maxX, src, goalLo, goalHi, subOptimal, jumpNext, jumpStarts, budget):
+    stateCell = jumpNext.shape[0]
+    dist = np.full(maxX * maxY * stateCell, np.inf)
+    prev = np.full(maxX * maxY * stateCell, -1, dtype=np.int64)
+    visited = np.zeros(maxX * maxY, dtype=np.bool_)
+    dist[src] = 0.0
+    heap = [(0.0, src)]
+    goals = []
+    popped = 0
+    pushed = 0
+    stale = 0
+    peakHeap = 1
+    exhausted = False
+
+    pathLength = np.inf
+    while len(heap) > 0:
+        if budget >= 0 and popped >= budget:
+            exhausted = True
+            break
+        d, state = heapq.heappop(heap)
+        popped += 1
+
+        if goalLo <= state < goalHi:
+            if d > pathLength + subOptimal:
+                break
+            if d < pathLength:
+                pathLength = d
+            goals.append((d, state))
+            continue
+        if d > dist[state]:
+            stale += 1
+            continue
+
+        cell = state // stateCell
+        phase = state % stateCell
+        x = cell // maxY
+        y = cell % maxY
+        visited[cell] = True
+        if y + 1 >= maxY:
+            continue
+        if jumpNext[phase, 2] >= 0:
+            dx = jumpNext[phase, 0]
+            dy = jumpNext[phase, 1]
+            if 0 <= x + dx < maxX and y + dy >= 0 and not solidCells[cell + dx * maxY + dy]:
+                pushed += relax(heap, dist, prev, d + 1.0, (cell + dx * maxY + dy) * stateCell + jumpNext[phase, 2],
+                                state)
+
+        if solidCells[cell + 1]:
+            if x + 1 < maxX and not solidCells[cell + maxY]:
+                pushed += relax(heap, dist, prev, d + 1.0, (cell + maxY) * stateCell, state)
+            if x - 1 >= 0 and not solidCells[cell - maxY]:
+                pushed += relax(heap, dist, prev, d + 1.0, (cell - maxY) * stateCell, state)
+
+            for i in range(jumpStarts.shape[0]):
+                dx = jumpStarts[i, 0]
+                dy = jumpStarts[i, 1]
+                if 0 <= x + dx < maxX and y + dy >= 0 and not solidCells[cell + dx * maxY + dy]:
+                    pushed += relax(heap, dist, prev, d + 1.0, (cell + dx * maxY + dy) * stateCell + jumpStarts[i, 2],
+                                    state)
+
+        else:
+            pushed += relax(heap, dist, prev, d + 1.0, (cell + 1) * stateCell, state)
+            if x + 1 < maxX and not solidCells[cell + maxY + 1]:
+                pushed += relax(heap, dist, prev, d + 1.4, (cell + maxY + 1) * stateCell, state)
+            if x - 1 >= 0 and not solidCells[cell - maxY + 1]:
+                pushed += relax(heap, dist, prev, d + 1.4, (cell - maxY + 1) * stateCell, state)
+            if y + 2 < maxY:
+                if x + 1 < maxX and not solidCells[cell + maxY + 2]:
+                    pushed += relax(heap, dist, prev, d + 2.0, (cell + maxY + 2) * stateCell, state)
+                if x - 1 >= 0 and not solidCells[cell - maxY + 2]:
+                    pushed += relax(heap, dist, prev, d + 2.0, (cell - maxY + 2) * stateCell, state)
+        if len(heap) > peakHeap:
+            peakHeap = len(heap)
+
+    return goals, prev, visited, popped, pushed, stale, peakHeap, exhausted
+
+
+# Measure every level of the benchmark corpus with the Python search and with the kernel, and
+# print the measurements that differ.  Returns how many levels differed.
+def parity():
+    import benchmark
+    import metrics
+    setting = metrics.searchKernel
+    mismatches = 0
+    try:
+        for name, level in benchmark.corpus():
+            metrics.searchKernel = "python"
+            expected = metrics.metrics(level)
+            metrics.searchKernel = "kernel"
+            actual = metrics.metrics(level)
+            different = sorted(key for key in expected if actual.get(key) != expected[key])
+            print("%-30s %s" % (name, "ok" if not different else "DIFFERENT: " + ", ".join(
+                "%s %r != %r" % (key, actual.get(key), expected[key]) for key in different)))
+            mismatches += bool(different)
+    finally:
+        metrics.searchKernel = setting
+    print("Numba" if available else "No Numba (the kernel ran as plain Python)", "-",
+          mismatches, "level(s) differed")
+    return mismatches
+
+
+if __name__ == "__main__":
+    sys.exit(1 if parity() else 0)
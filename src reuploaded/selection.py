@@ -0,0 +1,57 @@
+import heapq
+import itertools
+import random
+
+# Ways of picking parents from a population.  Each takes the population and how many parents to
+# pick, and returns a list of that many (repeats allowed).  Only the order of fitnesses matters to
+# tournament, rank and truncation, so they work the same whether fitness is positive or not, and
+# none of them needs the population sorted beforehand.
+
+
+def fitness(individual):
+    return individual.fitness()
+
+
+# The fittest of size individuals drawn at random, count times: O(count * size).
+def tournament(population, count, size=2, key=fitness):
+    size = min(size, len(population))
+    return [max(random.sample(population, size), key=key) for _i in range(count)]
+
+
+# Linear ranking: the worst individual has weight 2 - pressure and the best has weight pressure
+# (1 <= pressure <= 2), whatever their fitnesses are.  O(N log N + count log N).
+def rank(population, count, pressure=1.5, key=fitness):
+    ranked = sorted(population, key=key)
+    last = max(len(ranked) - 1, 1)
+    weights = [(2 - pressure) + 2 * (pressure - 1) * r / last for r in range(len(ranked))]
+    return random.choices(ranked, cum_weights=list(itertools.accumulate(weights)), k=count)
+
+
+# Uniformly from the best fraction of the population.  O(N log M + count).
+def truncation(population, count, fraction=0.5, key=fitness):
+    best = heapq.nlargest(max(1, int(len(population) * fraction)), population, key=key)
+    return [random.choice(best) for _i in range(count)]
+
+
+# Fitness-proportional, with fitness shifted so the worst individual has weight zero (everyone is
+# equally likely if all fitnesses are the same).  O(N + count log N).
+def roulette(population, count, key=fitness):
+    values = [key(individual) for individual in population]
+    lowest = min(values)
+    weights = [value - lowest for value in values]
+    if sum(weights) <= 0:
+        return [random.choice(population) for _i in range(count)]
+    return random.choices(population, weights=weights, k=count)
+
+
+# The count fittest individuals, best first.  O(N log count).
+def elite(population, count, key=fitness):
+    return heapq.nlargest(count, population, key=key)
+
+
+methods = {
+    "tournament": tournament,
+    "rank": rank,
+    "truncation": truncation,
+    "roulette": roulette,
+}
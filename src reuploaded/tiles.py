@@ -0,0 +1,60 @@
+import numpy as np
+
+# Fixed tile-code table for compact levels: a tile's code is its index in this string.
+# The first twelve are the tiles the GA places; the rest only appear in hand-made levels
+# (and "*", which metrics uses to mark visited cells).
+tile_chars = "-X?MBo|TEfvm" + "QSb[]<>*"
+tile_codes = {c: i for i, c in enumerate(tile_chars)}
+
+EMPTY = tile_codes["-"]
+WALL = tile_codes["X"]
+QBLOCK = tile_codes["?"]
+MUSHROOM = tile_codes["M"]
+BREAKABLE = tile_codes["B"]
+COIN = tile_codes["o"]
+PIPE = tile_codes["|"]
+PIPE_TOP = tile_codes["T"]
+ENEMY = tile_codes["E"]
+FLAG = tile_codes["f"]
+FLAGPOLE = tile_codes["v"]
+START = tile_codes["m"]
+
+# code -> ascii byte, and ascii byte -> code (255 marks characters outside the table)
+_to_ascii = np.frombuffer(tile_chars.encode("ascii"), dtype=np.uint8)
+_from_ascii = np.full(256, 255, dtype=np.uint8)
+_from_ascii[_to_ascii] = np.arange(len(tile_chars), dtype=np.uint8)
+
+
+def is_compact(level):
+    return isinstance(level, np.ndarray)
+
+
+# Turn a level (list of strings or list of lists of characters) into a height x width uint8 array.
+def encode(level):
+    if is_compact(level):
+        return level
+    rows = ["".join(row) for row in level]
+    raw = np.frombuffer("".join(rows).encode("ascii"), dtype=np.uint8)
+    grid = _from_ascii[raw]
+    if (grid == 255).any():
+        bad = sorted(set(chr(c) for c in raw[grid == 255]))
+        raise ValueError("Tiles not in the tile-code table: " + repr("".join(bad)))
+    return grid.reshape(len(rows), len(rows[0]))
+
+
+# Turn a compact level back into the list-of-lists-of-characters genome format.
+def decode(grid):
+    return [list(row) for row in rows(grid)]
+
+
+# A compact level as an array of ascii character codes.
+def to_ascii(grid):
+    return _to_ascii[grid]
+
+
+# The level as a list of strings, one per row, whichever representation it is in.
+# This is what the level writers consume.
+def rows(level):
+    if is_compact(level):
+        return [row.tobytes().decode("ascii") for row in to_ascii(level)]
+    return ["".join(row) for row in level]